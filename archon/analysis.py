@@ -1,6 +1,6 @@
 import dataclasses
 from enum import Enum
-from typing import List, Optional, Tuple
+from typing import List, Optional, Sequence, Tuple, Union
 
 import numpy
 
@@ -28,24 +28,40 @@ class AnalysisTarget:
 
 
 class AnalysisEngine:
+    """
+    Rolling analysis of the most recent ``history_size`` live analysis frames.
+
+    Frames live in a single preallocated ring buffer, alongside running sums of
+    every field, so intake and emission cost the same whatever the history size.
+    Running sums are periodically recomputed, so floating point error can't
+    accumulate.
+    """
+
     def __init__(self, config: ArchonConfig):
         self.config = config
         self.index = 0
-        self.peak: numpy.ndarray = numpy.ndarray(config.history_size)
-        self.rms: numpy.ndarray = numpy.ndarray(config.history_size)
-        self.f0: numpy.ndarray = numpy.ndarray(config.history_size)
-        self.is_voiced: numpy.ndarray = numpy.ndarray(
-            config.history_size, dtype=numpy.bool_
-        )
-        self.is_onset: numpy.ndarray = numpy.ndarray(
-            config.history_size, dtype=numpy.bool_
-        )
-        self.centroid: numpy.ndarray = numpy.ndarray(config.history_size)
-        self.flatness: numpy.ndarray = numpy.ndarray(config.history_size)
-        self.rolloff: numpy.ndarray = numpy.ndarray(config.history_size)
-        self.mfcc: numpy.ndarray = numpy.ndarray(
-            (config.history_size, config.mfcc_count)
+        names = [
+            "peak",
+            "rms",
+            "f0",
+            "is_voiced",
+            "is_onset",
+            "centroid",
+            "flatness",
+            "rolloff",
+            "voiced_f0",  # f0 if voiced, otherwise 0
+        ]
+        self.dtype = numpy.dtype(
+            [(name, numpy.float64) for name in names]
+            + [("mfcc", numpy.float64, (config.mfcc_count,))]
         )
+        # the first column of each field, mfcc last
+        self.columns = {name: i for i, name in enumerate(names + ["mfcc"])}
+        self.history = numpy.zeros(config.history_size, dtype=self.dtype)
+        # a (history x columns) view of the same memory
+        self.frames = self.history.view(numpy.float64).reshape(config.history_size, -1)
+        self.sums = numpy.zeros(self.frames.shape[1])
+        self.previous_rms = -numpy.inf
 
     def intake(
         self,
@@ -59,36 +75,78 @@ class AnalysisEngine:
         flatness: float,
         rolloff: float,
         mfcc: List[float],
-    ):
-        index = self.index % self.config.history_size
-        self.peak[index] = peak
-        self.rms[index] = rms
-        self.f0[index] = f0
-        self.is_voiced[index] = is_voiced
-        self.is_onset[index] = is_onset
-        self.centroid[index] = centroid
-        self.flatness[index] = flatness
-        self.rolloff[index] = rolloff
-        self.mfcc[index] = mfcc
-        self.index += 1
+    ) -> bool:
+        """
+        Take in an analysis frame, returning whether it should trigger emission.
+        """
+        return self.intake_many(
+            [[peak, rms, f0, is_voiced, is_onset, centroid, flatness, rolloff, *mfcc]]
+        )
+
+    def intake_many(
+        self, frames: Union[numpy.ndarray, Sequence[Sequence[float]]]
+    ) -> bool:
+        """
+        Take in analysis frames, laid out as in ``/analysis`` replies, returning
+        whether any should trigger emission.
+
+        Onsets trigger if so configured, as does RMS rising across the
+        configured threshold.
+        """
+        array = numpy.atleast_2d(numpy.asarray(frames, dtype=numpy.float64))
+        count, history_size = len(array), self.config.history_size
+        is_voiced, is_onset, rms = array[:, 3] != 0, array[:, 4] != 0, array[:, 1]
+        previous_rms = numpy.append(self.previous_rms, rms[:-1])
+        is_triggered = bool(
+            (self.config.trigger_on_onsets and is_onset.any())
+            or (
+                (threshold := self.config.trigger_rms_threshold) is not None
+                and ((previous_rms < threshold) & (threshold <= rms)).any()
+            )
+        )
+        self.previous_rms = rms[-1]
+        # only the most recent frames fit, laid out with voiced f0 before MFCCs
+        skip = max(count - history_size, 0)
+        voiced_f0 = numpy.where(is_voiced, array[:, 2], 0.0)
+        rows = numpy.insert(
+            array[skip:], self.columns["voiced_f0"], voiced_f0[skip:], axis=1
+        )
+        rows[:, self.columns["is_voiced"]] = is_voiced[skip:]
+        rows[:, self.columns["is_onset"]] = is_onset[skip:]
+        start = self.index + skip
+        positions = numpy.arange(start, self.index + count) % history_size
+        self.sums -= self.frames[positions].sum(axis=0)
+        self.frames[positions] = rows
+        self.sums += rows.sum(axis=0)
+        cycle = self.index // history_size
+        self.index += count
+        if self.index // history_size != cycle:
+            self.sums = self.frames.sum(axis=0)
+        return is_triggered
+
+    def get_mean(self, name: str) -> float:
+        return float(self.sums[self.columns[name]] / self.config.history_size)
 
     def emit(self) -> Tuple[Optional[AnalysisTarget], float, float]:
         min_sleep, max_sleep = 0.1, 1.0
         if self.index < self.config.history_size:
             return None, min_sleep, max_sleep
         f0 = -1.0
-        if numpy.median(self.is_voiced):
-            f0 = self.f0[self.is_voiced].mean()
+        # the median of booleans is truthy when at least half are true
+        voiced_count = round(self.sums[self.columns["is_voiced"]])
+        if voiced_count and 2 * voiced_count >= self.config.history_size:
+            f0 = self.sums[self.columns["voiced_f0"]] / voiced_count
+        mfcc_column = self.columns["mfcc"]
         analysis_target = AnalysisTarget(
             pattern_flavor=PatternFlavor.WARP,
             k=25,
-            peak=float(self.peak.mean()),
-            rms=float(self.rms.mean()),
+            peak=self.get_mean("peak"),
+            rms=self.get_mean("rms"),
             f0=float(f0),
-            is_onset=float(self.is_onset.mean()),
-            centroid=float(self.centroid.mean()),
-            flatness=float(self.flatness.mean()),
-            rolloff=float(self.rolloff.mean()),
-            mfcc=self.mfcc.mean(axis=0).tolist(),
+            is_onset=self.get_mean("is_onset"),
+            centroid=self.get_mean("centroid"),
+            flatness=self.get_mean("flatness"),
+            rolloff=self.get_mean("rolloff"),
+            mfcc=(self.sums[mfcc_column:] / self.config.history_size).tolist(),
         )
         return analysis_target, min_sleep, max_sleep
@@ -1,40 +1,189 @@
+import asyncio
 import logging
+from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, List, Set, Union
-from uuid import UUID
+from time import perf_counter
+from typing import Dict, List, Optional, Set, Tuple, Union
+from uuid import UUID, uuid4
 
 from supriya.providers import BufferProxy, Provider
 
 from .query import Entry
+from .utils import Histogram
 
 logger = logging.getLogger(__name__)
 
 
 class BufferManager:
-    def __init__(self, provider: Provider, root_path: Path):
+    """
+    Reference-counted allocation of buffers for entries.
+
+    Unreferenced buffers are freed immediately, unless pooled: with a
+    ``pool_size``, up to that many unreferenced buffers stay resident (and, with
+    ``pool_megabytes``, only up to that much sample data), so entries queried
+    again soon don't need reading from disk again. Pooled buffers are evicted
+    least recently used first.
+
+    With ``coalesce``, overlapping or adjacent entries from the same file share
+    one buffer of their combined region, and entries within an already
+    allocated region reuse its buffer. Synths then play the entry's region of
+    the buffer, per ``get_region``.
+
+    Buffers are read asynchronously by the server, so are pending until their
+    ``/done`` reply is passed to ``on_done``, and can be waited on with
+    ``wait_until_ready``. The time between allocation and readiness is kept in a
+    latency histogram.
+
+    Every resident buffer's size is accounted for. With ``budget_megabytes``,
+    ``admit`` chooses which entries may be allocated without exceeding it.
+    """
+
+    def __init__(
+        self,
+        provider: Provider,
+        root_path: Path,
+        pool_size: int = 0,
+        pool_megabytes: Optional[float] = None,
+        coalesce: bool = False,
+        budget_megabytes: Optional[float] = None,
+    ):
         self.provider = provider
+        self.budget_megabytes = budget_megabytes
         self.root_path = root_path
+        self.coalesce = coalesce
+        self.pool_size = pool_size
+        self.pool_megabytes = pool_megabytes
         self.buffers_to_entities: Dict[BufferProxy, Set[Union[UUID, int]]] = {}
         self.buffers_to_entries: Dict[BufferProxy, Entry] = {}
         self.entities_to_buffers: Dict[Union[UUID, int], Set[BufferProxy]] = {}
         self.entries_to_buffers: Dict[Entry, BufferProxy] = {}
+        # every entry sharing each buffer, including its region
+        self.buffers_to_members: Dict[BufferProxy, Set[Entry]] = {}
+        # unreferenced but resident buffers, least recently used first
+        self.pool: OrderedDict[BufferProxy, None] = OrderedDict()
+        self.pool_bytes = 0
+        # all resident buffers, referenced or pooled
+        self.resident_bytes = 0
+        # buffer IDs read but not yet done, with when they were allocated
+        self.pending: Dict[int, Tuple[asyncio.Event, float]] = {}
+        self.latencies = Histogram()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def hit_rate(self) -> float:
+        if not (total := self.hits + self.misses):
+            return 0.0
+        return self.hits / total
+
+    @property
+    def megabytes(self) -> float:
+        return self.resident_bytes / 2**20
+
+    @staticmethod
+    def get_byte_count(entry: Entry) -> int:
+        # mono, 32-bit float samples
+        return entry.frame_count * 4
+
+    def get_region(self, entry: Entry) -> Tuple[float, float]:
+        """
+        Get an allocated entry's start and length, as fractions of its buffer.
+        """
+        region = self.buffers_to_entries[self.entries_to_buffers[entry]]
+        return (
+            (entry.starting_frame - region.starting_frame) / region.frame_count,
+            entry.frame_count / region.frame_count,
+        )
+
+    def get_regions(self, entries: List[Entry]) -> Dict[Entry, Entry]:
+        """
+        Plan the regions to allocate unallocated entries in.
+
+        Entries within an allocated region of the same file use that region, and
+        overlapping or adjacent entries are merged into one region.
+        """
+        regions: Dict[Entry, Entry] = {}
+        entries_by_path: Dict[Path, List[Entry]] = {}
+        for entry in entries:
+            if entry not in self.entries_to_buffers:
+                entries_by_path.setdefault(entry.path, []).append(entry)
+        for path, path_entries in entries_by_path.items():
+            allocated_regions = [
+                region
+                for region in self.buffers_to_entries.values()
+                if region.path == path
+            ]
+            groups: List[List[Entry]] = []
+            for entry in sorted(set(path_entries), key=lambda x: x.starting_frame):
+                stop_frame = entry.starting_frame + entry.frame_count
+                for region in allocated_regions:
+                    if (
+                        region.starting_frame <= entry.starting_frame
+                        and stop_frame <= region.starting_frame + region.frame_count
+                    ):
+                        regions[entry] = region
+                        break
+                else:
+                    if groups and entry.starting_frame <= max(
+                        x.starting_frame + x.frame_count for x in groups[-1]
+                    ):
+                        groups[-1].append(entry)
+                    else:
+                        groups.append([entry])
+            for group in groups:
+                if len(group) == 1:
+                    continue
+                starting_frame = group[0].starting_frame
+                region = Entry(
+                    path=path,
+                    starting_frame=starting_frame,
+                    frame_count=max(x.starting_frame + x.frame_count for x in group)
+                    - starting_frame,
+                    digest="",
+                )
+                regions.update((entry, region) for entry in group)
+        return regions
 
     def increment(
-        self, entry_or_buffer_id: Union[Entry, BufferProxy], reference: Union[UUID, int]
+        self,
+        entry_or_buffer_id: Union[Entry, BufferProxy],
+        reference: Union[UUID, int],
+        region: Optional[Entry] = None,
     ) -> BufferProxy:
+        """
+        Reference an entry's buffer, allocating it (or the region of the file
+        containing it) if necessary.
+        """
         logger.debug(f"Incrementing {reference}")
         if isinstance(entry_or_buffer_id, Entry):
             entry = entry_or_buffer_id
-            if entry not in self.entries_to_buffers:
+            if region is None:
+                region = entry
+            if (
+                entry not in self.entries_to_buffers
+                and region in self.entries_to_buffers
+            ):
+                # another entry in the same region was allocated first
+                buffer_id = self.entries_to_buffers[region]
+                self.entries_to_buffers[entry] = buffer_id
+                self.buffers_to_members[buffer_id].add(entry)
+                logger.debug(f"Already allocated region: {int(buffer_id)}")
+            elif entry not in self.entries_to_buffers:
                 buffer_ = self.provider.add_buffer(
                     channel_count=1,
-                    file_path=self.root_path / entry.path,
-                    starting_frame=entry.starting_frame,
-                    frame_count=entry.frame_count,
+                    file_path=self.root_path / region.path,
+                    starting_frame=region.starting_frame,
+                    frame_count=region.frame_count,
                 )
-                self.buffers_to_entries[buffer_] = entry
+                self.buffers_to_entries[buffer_] = region
+                self.buffers_to_members[buffer_] = {entry, region}
                 self.entries_to_buffers[entry] = buffer_
+                self.entries_to_buffers[region] = buffer_
                 buffer_id = self.entries_to_buffers[entry]
+                self.pending[int(buffer_id)] = (asyncio.Event(), perf_counter())
+                self.resident_bytes += self.get_byte_count(region)
+                self.misses += 1
                 logger.debug(f"Allocating {int(buffer_id)}")
             else:
                 buffer_id = self.entries_to_buffers[entry]
@@ -42,6 +191,11 @@ class BufferManager:
         else:
             buffer_id = entry_or_buffer_id
             logger.debug(f"Already allocated: {int(buffer_id)}")
+        if buffer_id in self.pool:
+            logger.debug(f"Reusing pooled {int(buffer_id)}")
+            self.hits += 1
+            self.pool.pop(buffer_id)
+            self.pool_bytes -= self.get_byte_count(self.buffers_to_entries[buffer_id])
         self.buffers_to_entities.setdefault(buffer_id, set()).add(reference)
         self.entities_to_buffers.setdefault(reference, set()).add(buffer_id)
         return buffer_id
@@ -49,7 +203,10 @@ class BufferManager:
     def increment_multiple(
         self, entries: List[Entry], reference: UUID
     ) -> List[BufferProxy]:
-        return [self.increment(entry, reference) for entry in entries]
+        regions = self.get_regions(entries) if self.coalesce else {}
+        return [
+            self.increment(entry, reference, regions.get(entry)) for entry in entries
+        ]
 
     def decrement(self, reference: Union[UUID, int], free=True):
         logger.debug(f"Decrementing {reference}")
@@ -57,8 +214,168 @@ class BufferManager:
             references = self.buffers_to_entities[buffer_id]
             references.remove(reference)
             if not references and free:
-                logger.debug(f"Freeing {int(buffer_id)}")
                 self.buffers_to_entities.pop(buffer_id)
-                entry = self.buffers_to_entries.pop(buffer_id)
-                self.entries_to_buffers.pop(entry)
-                self.provider.free_buffer(buffer_id)
+                if not self.pool_size:
+                    self.free(buffer_id)
+                    continue
+                logger.debug(f"Pooling {int(buffer_id)}")
+                self.pool[buffer_id] = None
+                self.pool_bytes += self.get_byte_count(
+                    self.buffers_to_entries[buffer_id]
+                )
+        self.evict()
+
+    def preload(self, entries: List[Entry], megabytes: Optional[float] = None) -> int:
+        """
+        Load entries straight into the pool, in order, until it's full or they
+        total ``megabytes``, returning how many were loaded.
+
+        Preloaded entries aren't coalesced, so each takes a buffer of its own
+        size, as budgeted. Preloading doesn't count towards hits and misses.
+        """
+        byte_limits = []
+        if megabytes is not None:
+            byte_limits.append(megabytes * 2**20)
+        if self.pool_megabytes is not None:
+            byte_limits.append(self.pool_megabytes * 2**20 - self.pool_bytes)
+        if self.budget_megabytes is not None:
+            byte_limits.append(self.budget_megabytes * 2**20 - self.resident_bytes)
+        max_bytes = min(byte_limits, default=None)
+        selected: List[Entry] = []
+        byte_count = 0
+        for entry in entries:
+            if len(self.pool) + len(selected) >= self.pool_size:
+                break
+            if entry in self.entries_to_buffers:
+                continue
+            if (
+                max_bytes is not None
+                and byte_count + self.get_byte_count(entry) > max_bytes
+            ):
+                break
+            selected.append(entry)
+            byte_count += self.get_byte_count(entry)
+        if not selected:
+            return 0
+        hits, misses, reference = self.hits, self.misses, uuid4()
+        for entry in selected:
+            self.increment(entry, reference)
+        self.decrement(reference)
+        self.hits, self.misses = hits, misses
+        logger.debug(f"Preloaded {len(selected)} entries")
+        return len(selected)
+
+    def get_allocation_bytes(self, entries: List[Entry]) -> int:
+        """
+        Count the bytes allocating entries would add, costing the regions they'd
+        be coalesced into rather than the entries themselves, if coalescing.
+        """
+        regions = self.get_regions(entries) if self.coalesce else {}
+        return sum(
+            self.get_byte_count(region)
+            for region in {regions.get(x, x) for x in entries}
+            if region not in self.entries_to_buffers
+        )
+
+    def admit(self, entries: List[Entry], count: int) -> List[Entry]:
+        """
+        Choose up to ``count`` entries, in order, that fit within the budget.
+
+        Resident entries, and entries within resident regions if coalescing, cost
+        nothing, so are chosen first, substituting for unloaded entries. Unloaded
+        entries are then chosen while the regions they'd be allocated in fit,
+        counting pooled buffers as reclaimable, and pooled buffers are evicted to
+        make room for them. Without a budget, the first ``count`` are chosen.
+        """
+        if self.budget_megabytes is None:
+            return entries[:count]
+        max_bytes = self.budget_megabytes * 2**20
+        regions = self.get_regions(entries) if self.coalesce else {}
+        buffers = {
+            x: self.entries_to_buffers[region]
+            for x in entries
+            if (region := regions.get(x, x)) in self.entries_to_buffers
+        }
+        admitted = set(list(buffers)[:count])
+        needed_buffers = {buffers[x] for x in admitted}
+        evictable_bytes = sum(
+            self.get_byte_count(self.buffers_to_entries[x])
+            for x in self.pool
+            if x not in needed_buffers
+        )
+        unloaded: List[Entry] = []
+        new_bytes = 0
+        for entry in entries:
+            if len(admitted) >= count:
+                break
+            if entry in admitted or entry in buffers:
+                continue
+            byte_count = self.get_allocation_bytes(unloaded + [entry])
+            if self.resident_bytes - evictable_bytes + byte_count > max_bytes:
+                continue
+            admitted.add(entry)
+            unloaded.append(entry)
+            new_bytes = byte_count
+        for buffer_id in list(self.pool):
+            if self.resident_bytes + new_bytes <= max_bytes:
+                break
+            if buffer_id not in needed_buffers:
+                self.evict_buffer(buffer_id)
+        return [x for x in entries if x in admitted]
+
+    def evict(self) -> None:
+        """
+        Free least recently used pooled buffers until the pool fits its bounds.
+        """
+        max_bytes = None
+        if self.pool_megabytes is not None:
+            max_bytes = self.pool_megabytes * 2**20
+        while self.pool and (
+            len(self.pool) > self.pool_size
+            or (max_bytes is not None and self.pool_bytes > max_bytes)
+        ):
+            self.evict_buffer(next(iter(self.pool)))
+
+    def evict_buffer(self, buffer_id: BufferProxy) -> None:
+        self.pool.pop(buffer_id)
+        self.pool_bytes -= self.get_byte_count(self.buffers_to_entries[buffer_id])
+        self.evictions += 1
+        self.free(buffer_id)
+
+    def is_ready(self, buffer_id: BufferProxy) -> bool:
+        return int(buffer_id) not in self.pending
+
+    def on_done(self, buffer_id: int) -> None:
+        """
+        Mark a buffer as read, on its ``/done /b_allocRead`` reply.
+        """
+        if (pending := self.pending.pop(buffer_id, None)) is None:
+            return
+        event, allocated_at = pending
+        self.latencies.add(perf_counter() - allocated_at)
+        event.set()
+
+    async def wait_until_ready(
+        self, buffer_ids: List[BufferProxy], timeout: float
+    ) -> List[bool]:
+        """
+        Wait up to ``timeout`` seconds for buffers to be read, returning which are.
+        """
+        if events := {
+            self.pending[int(x)][0] for x in buffer_ids if int(x) in self.pending
+        }:
+            tasks = [asyncio.create_task(event.wait()) for event in events]
+            _, waiting = await asyncio.wait(tasks, timeout=timeout)
+            for task in waiting:
+                task.cancel()
+        return [self.is_ready(x) for x in buffer_ids]
+
+    def free(self, buffer_id: BufferProxy) -> None:
+        logger.debug(f"Freeing {int(buffer_id)}")
+        self.pending.pop(int(buffer_id), None)
+        self.resident_bytes -= self.get_byte_count(
+            self.buffers_to_entries.pop(buffer_id)
+        )
+        for entry in self.buffers_to_members.pop(buffer_id):
+            self.entries_to_buffers.pop(entry)
+        self.provider.free_buffer(buffer_id)
@@ -3,19 +3,33 @@ import dataclasses
 from pathlib import Path
 from typing import Tuple
 
-from . import harness, pipeline
+from . import harness, pipeline, query
 from .config import ArchonConfig
 
 
-def build_harness_subparser(subparsers):
-    parser = subparsers.add_parser("run-harness")
-    parser.add_argument("path", help="path to analysis JSON", type=Path)
+class FeatureWeightsAction(argparse.Action):
+    def __call__(self, parser, namespace, values, option_string=None):
+        feature_weights = {}
+        for value in values:
+            name, _, weight = value.partition("=")
+            try:
+                feature_weights[name] = float(weight)
+            except ValueError:
+                parser.error(f"{option_string}: expected NAME=WEIGHT, got {value!r}")
+        setattr(namespace, self.dest, feature_weights)
+
+
+def add_query_arguments(parser):
     parser.add_argument(
-        "--history-size",
-        default=10,
-        metavar="N",
-        help="windows size for live analysis (default: %(default)d)",
-        type=int,
+        "--feature-weights",
+        action=FeatureWeightsAction,
+        default={},
+        help=(
+            "weight distances along features, e.g. f0=0.1 mfcc=2 "
+            "(features: centroid, f0, flatness, mfcc, rms, rolloff)"
+        ),
+        metavar="NAME=WEIGHT",
+        nargs="+",
     )
     parser.add_argument(
         "--mfcc-count",
@@ -42,6 +56,158 @@ def build_harness_subparser(subparsers):
         default=True,
         help="use spectral features for querying (default: %(default)s)",
     )
+    parser.add_argument(
+        "--whiten",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="whiten features against the corpus covariance (default: %(default)s)",
+    )
+
+
+def add_index_arguments(parser):
+    parser.add_argument(
+        "--ivf-list-count",
+        help="number of inverted file index lists (default: 4 x sqrt(partitions))",
+        metavar="N",
+        type=int,
+    )
+    parser.add_argument(
+        "--ivf-probe-count",
+        default=8,
+        help="number of inverted file index lists to search (default: %(default)d)",
+        metavar="N",
+        type=int,
+    )
+
+
+def add_index_structure_arguments(parser):
+    parser.add_argument(
+        "--index-type",
+        choices=["ivf", "kdtree"],
+        default="kdtree",
+        help="exact k-d tree or approximate inverted file index (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--use-pitch-buckets",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="search only partitions of a similar pitch (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--pitch-bucket-minimum-size",
+        default=100,
+        help="widen pitch buckets smaller than this to nearby octaves "
+        "(default: %(default)d)",
+        metavar="N",
+        type=int,
+    )
+
+
+def build_benchmark_subparser(subparsers):
+    parser = subparsers.add_parser("benchmark-index")
+    parser.add_argument("path", help="path to analysis JSON", type=Path)
+    add_index_arguments(parser)
+    add_query_arguments(parser)
+
+
+def build_harness_subparser(subparsers):
+    parser = subparsers.add_parser("run-harness")
+    parser.add_argument("path", help="path to analysis JSON", type=Path)
+    parser.add_argument(
+        "--history-size",
+        default=10,
+        metavar="N",
+        help="windows size for live analysis (default: %(default)d)",
+        type=int,
+    )
+    add_index_structure_arguments(parser)
+    add_index_arguments(parser)
+    add_query_arguments(parser)
+    parser.add_argument(
+        "--query-cache-size",
+        default=256,
+        help="number of query results to cache, or 0 for none (default: %(default)d)",
+        metavar="N",
+        type=int,
+    )
+    parser.add_argument(
+        "--query-cache-step",
+        default=0.05,
+        help="quantization step of cached query points (default: %(default)s)",
+        type=float,
+    )
+    parser.add_argument(
+        "--buffer-budget-megabytes",
+        help="maximum size of all loaded buffers, shrinking queries to fit",
+        metavar="MB",
+        type=float,
+    )
+    parser.add_argument(
+        "--buffer-pool-size",
+        default=0,
+        help="number of unused buffers to keep loaded, or 0 for none (default: %(default)d)",
+        metavar="N",
+        type=int,
+    )
+    parser.add_argument(
+        "--buffer-pool-megabytes",
+        help="maximum size of unused buffers to keep loaded (default: unbounded)",
+        metavar="MB",
+        type=float,
+    )
+    parser.add_argument(
+        "--buffer-ready-timeout",
+        default=0.5,
+        help="seconds to wait for buffers to load, or 0 to not wait (default: %(default)s)",
+        metavar="SECONDS",
+        type=float,
+    )
+    parser.add_argument(
+        "--warm-up-megabytes",
+        default=0.0,
+        help="preload up to this much of the buffer pool while booting (default: %(default)s)",
+        metavar="MB",
+        type=float,
+    )
+    parser.add_argument(
+        "--coalesce-buffers",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="share one buffer among overlapping entries of a file (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--analysis-rate",
+        default=10.0,
+        help="live analysis frames per second (default: %(default)s)",
+        metavar="HZ",
+        type=float,
+    )
+    parser.add_argument(
+        "--analysis-batch-size",
+        default=1,
+        help="live analysis frames per OSC reply (default: %(default)d)",
+        metavar="N",
+        type=int,
+    )
+    parser.add_argument(
+        "--trigger-on-onsets",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="query as soon as an onset is detected (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--trigger-rms-threshold",
+        help="query as soon as RMS rises across this level, in dB",
+        metavar="DB",
+        type=float,
+    )
+    parser.add_argument(
+        "--trigger-cooldown",
+        default=0.1,
+        help="minimum seconds between triggered queries (default: %(default)s)",
+        metavar="SECONDS",
+        type=float,
+    )
     parser.add_argument("--input-count", type=int, default=8)
     parser.add_argument("--output-count", type=int, default=8)
     parser.add_argument("--input-device", required=False)
@@ -49,6 +215,13 @@ def build_harness_subparser(subparsers):
     parser.add_argument(
         "--input-bus", type=int, default=8, help="bus ID to run analysis against"
     )
+    parser.add_argument(
+        "--analysis-channel-count",
+        default=1,
+        help="number of consecutive input buses to analyze (default: %(default)d)",
+        metavar="N",
+        type=int,
+    )
     parser.add_argument(
         "--output-bus", type=int, default=0, help="bus ID to output audio to"
     )
@@ -57,8 +230,49 @@ def build_harness_subparser(subparsers):
 def build_pipeline_subparser(subparsers):
     parser = subparsers.add_parser("run-pipeline")
     parser.add_argument("path", help="path to analysis JSON", type=Path)
+    parser.add_argument(
+        "--analysis-backend",
+        choices=["librosa", "nrt"],
+        default="nrt",
+        help="analyze via scsynth NRT or in-process via librosa (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--cpu-budget",
+        help="number of concurrent analysis workers (default: half the CPUs)",
+        metavar="N",
+        type=int,
+    )
+    parser.add_argument(
+        "--nrt-chunk-duration",
+        default=600.0,
+        help="render NRT analyses of longer files in chunks (default: %(default)s)",
+        metavar="SECONDS",
+        type=float,
+    )
     parser.add_argument("--partition-hop-in-ms", default=500.0, type=float)
     parser.add_argument("--partition-sizes-in-ms", nargs="+", type=float)
+    parser.add_argument(
+        "--use-cache",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="reuse cached per-file analyses (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--cache-directory",
+        help="where to cache per-file analyses "
+        "(default: .archon-cache beside the analysis JSON, in the sample library)",
+        metavar="PATH",
+        type=Path,
+    )
+    parser.add_argument(
+        "--build-index",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="persist a query index for the query arguments (default: %(default)s)",
+    )
+    add_index_structure_arguments(parser)
+    add_index_arguments(parser)
+    add_query_arguments(parser)
 
 
 def build_validate_subparser(subparsers):
@@ -69,6 +283,7 @@ def build_validate_subparser(subparsers):
 def parse_args(args=None) -> Tuple[str, ArchonConfig]:
     parser = argparse.ArgumentParser()
     subparsers = parser.add_subparsers(dest="command", required=True)
+    build_benchmark_subparser(subparsers)
     build_harness_subparser(subparsers)
     build_pipeline_subparser(subparsers)
     build_validate_subparser(subparsers)
@@ -85,6 +300,7 @@ def parse_args(args=None) -> Tuple[str, ArchonConfig]:
 def main(args=None):
     command, config = parse_args()
     {
+        "benchmark-index": query.benchmark,
         "run-pipeline": pipeline.run,
         "validate-analysis": pipeline.validate,
         "run-harness": harness.run,
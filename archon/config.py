@@ -1,16 +1,34 @@
 import dataclasses
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 
 @dataclasses.dataclass
 class ArchonConfig:
     analysis_path: Path
+    analysis_backend: str = "nrt"
+    analysis_batch_size: int = 1
+    analysis_channel_count: int = 1  # consecutive input buses, from input_bus
+    analysis_rate: float = 10.0  # Hz
+    buffer_budget_megabytes: Optional[float] = None  # None for no budget
+    buffer_pool_megabytes: Optional[float] = None  # None to bound by count only
+    buffer_pool_size: int = 0  # 0 to free buffers immediately
+    buffer_ready_timeout: float = 0.5  # seconds, 0 to play without waiting
+    build_index: bool = False
+    cache_directory: Optional[Path] = None  # None for .archon-cache beside analysis
+    coalesce_buffers: bool = False
+    cpu_budget: Optional[int] = None
+    feature_weights: Dict[str, float] = dataclasses.field(default_factory=dict)
     history_size: int = 10
+    index_type: str = "kdtree"
     input_bus: int = 8
     input_count: int = 8
     input_device: Optional[str] = None
+    ivf_list_count: Optional[int] = None  # default 4 * sqrt(partitions)
+    ivf_probe_count: int = 8
     mfcc_count: int = 13
+    nrt_chunk_duration: float = 600.0  # seconds, 0 to never chunk
+    nrt_chunk_overlap: float = 2.0  # seconds
     output_bus: int = 0
     output_count: int = 8
     output_device: Optional[str] = None
@@ -18,14 +36,28 @@ class ArchonConfig:
     partition_sizes_in_ms: List[float] = dataclasses.field(
         default_factory=lambda: [500]
     )
+    pitch_bucket_minimum_size: int = 100
     pitch_detection_max_frequency: float = 3000.0
     pitch_detection_min_frequency: float = 200.0  # normally 60
     polyphony: int = 10
+    query_cache_size: int = 256  # 0 to never cache
+    query_cache_step: float = 0.05
     reverb_mix: float = 0.1
     silence_threshold_db: float = -60.0
+    trigger_cooldown: float = 0.1  # seconds
+    trigger_on_onsets: bool = False
+    trigger_rms_threshold: Optional[float] = None  # dB
+    use_cache: bool = True
     use_mfcc: bool = True
     use_pitch: bool = True
+    use_pitch_buckets: bool = False
     use_spectral: bool = True
+    warm_up_megabytes: float = 0.0  # 0 to not warm up
+    whiten: bool = False
+
+    @property
+    def cache_path(self) -> Path:
+        return self.cache_directory or self.root_path / ".archon-cache"
 
     @property
     def root_path(self) -> Path:
@@ -34,3 +66,17 @@ class ArchonConfig:
     def validate(self):
         if not any([self.use_pitch, self.use_spectral, self.use_mfcc]):
             raise ValueError
+        if self.analysis_backend not in ("librosa", "nrt"):
+            raise ValueError(self.analysis_backend)
+        if not 1 <= self.analysis_channel_count <= self.input_count:
+            raise ValueError(self.analysis_channel_count)
+        if self.warm_up_megabytes and not self.buffer_pool_size:
+            raise ValueError("Warming up requires a buffer pool")
+        if self.index_type not in ("ivf", "kdtree"):
+            raise ValueError(self.index_type)
+        if self.use_pitch_buckets and not self.use_pitch:
+            raise ValueError("Pitch buckets require pitch")
+        if unknown_features := set(self.feature_weights).difference(
+            ["centroid", "f0", "flatness", "mfcc", "rms", "rolloff"]
+        ):
+            raise ValueError(sorted(unknown_features))
@@ -1,9 +1,11 @@
 import asyncio
+import dataclasses
 import logging
 import random
-from typing import Dict, List, cast
+from typing import Dict, List, Optional, cast
 from uuid import UUID, uuid4
 
+import numpy
 from supriya.clocks import AsyncClock, ClockContext
 from supriya.osc import OscMessage
 from supriya.patterns import Event, NoteEvent, PatternPlayer, Priority, StopEvent
@@ -14,7 +16,7 @@ from .analysis import AnalysisEngine, AnalysisTarget
 from .buffers import BufferManager
 from .config import ArchonConfig
 from .patterns import PatternFactory
-from .query import Database
+from .query import Database, Entry
 from .synthdefs import build_online_analysis_synthdef, hdverb, limiter
 from .utils import scale
 
@@ -36,14 +38,28 @@ class Engine:
         self.server = AsyncServer()
         self.provider = Provider.from_context(self.server)
         self.osc_callbacks: List[OscCallbackProxy] = []
-        self.analysis_engine = AnalysisEngine(config)
-        self.buffer_manager = BufferManager(self.provider, config.root_path)
+        # one analysis engine per analyzed input channel, keyed by synth node ID
+        self.analysis_engines = [
+            AnalysisEngine(config) for _ in range(config.analysis_channel_count)
+        ]
+        self.analysis_engines_by_node_id: Dict[int, AnalysisEngine] = {}
+        # one trigger per analysis engine, set when its channel triggers
+        self.analysis_triggers = [asyncio.Event() for _ in self.analysis_engines]
+        self.buffer_manager = BufferManager(
+            self.provider,
+            config.root_path,
+            pool_size=config.buffer_pool_size,
+            pool_megabytes=config.buffer_pool_megabytes,
+            coalesce=config.coalesce_buffers,
+            budget_megabytes=config.buffer_budget_megabytes,
+        )
         self.clock = AsyncClock()
         self.database = Database.new(config)
         self.pattern_factory = PatternFactory()
         self.pattern_futures: Dict[UUID, asyncio.Future] = {}
         self.pattern_players: Dict[UUID, PatternPlayer] = {}
         self.periodic_tasks: List[asyncio.Task] = []
+        self.warm_up_task: Optional[asyncio.Task] = None
 
     async def boot_server(self) -> None:
         """
@@ -60,24 +76,28 @@ class Engine:
             output_bus_channel_count=self.config.output_count,
             output_device=self.config.output_device,
         )
-        for address, handler in {
-            "/analysis": self.on_analysis_osc_message,
-            "/n_end": self.on_n_end_osc_message,
+        for pattern, handler in {
+            ("/analysis",): self.on_analysis_osc_message,
+            ("/done", "/b_allocRead"): self.on_done_osc_message,
+            ("/n_end",): self.on_n_end_osc_message,
         }.items():
             self.osc_callbacks.append(
-                self.provider.register_osc_callback(
-                    pattern=(address,), procedure=handler
-                )
+                self.provider.register_osc_callback(pattern=pattern, procedure=handler)
             )
+        analysis_synthdef = build_online_analysis_synthdef(
+            batch_size=self.config.analysis_batch_size,
+            mfcc_count=self.config.mfcc_count,
+            pitch_detection_max_frequency=self.config.pitch_detection_max_frequency,
+            pitch_detection_min_frequency=self.config.pitch_detection_min_frequency,
+        )
         async with self.provider.at():
-            self.provider.add_synth(
-                in_=self.config.input_bus,
-                synthdef=build_online_analysis_synthdef(
-                    mfcc_count=self.config.mfcc_count,
-                    pitch_detection_max_frequency=self.config.pitch_detection_max_frequency,
-                    pitch_detection_min_frequency=self.config.pitch_detection_min_frequency,
-                ),
-            )
+            for channel, analysis_engine in enumerate(self.analysis_engines):
+                synth = self.provider.add_synth(
+                    in_=self.config.input_bus + channel,
+                    synthdef=analysis_synthdef,
+                    tps=self.config.analysis_rate,
+                )
+                self.analysis_engines_by_node_id[int(synth)] = analysis_engine
             self.provider.add_synth(
                 add_action="ADD_TO_TAIL",
                 in_=self.config.output_bus,
@@ -91,6 +111,9 @@ class Engine:
                 out=self.config.output_bus,
                 synthdef=limiter,
             )
+        if self.config.warm_up_megabytes:
+            # warm up in the background, after boot, while the engine starts polling
+            self.warm_up_task = asyncio.get_running_loop().create_task(self.warm_up())
         logger.info("... server booted!")
 
     async def quit_server(self, graceful: bool = True) -> None:
@@ -102,12 +125,30 @@ class Engine:
             logger.warning("Server already quit!")
             return
         await self.stop(graceful=graceful)
+        if self.warm_up_task is not None:
+            self.warm_up_task.cancel()
+        self.database.save_entry_counts()
         for callback in self.osc_callbacks:
             self.provider.unregister_osc_callback(callback)
         await self.server.quit()
         await self.clock.stop()
         logger.info("... server quit!")
 
+    async def warm_up(self) -> None:
+        """
+        Preload the entries most likely to be played into the buffer pool.
+        """
+        logger.info("Warming up ...")
+        # finding entries can be slow, so keep it off the event loop
+        entries = await asyncio.get_running_loop().run_in_executor(
+            None, self.database.get_warm_entries, self.config.buffer_pool_size
+        )
+        async with self.provider.at():
+            count = self.buffer_manager.preload(
+                entries, megabytes=self.config.warm_up_megabytes
+            )
+        logger.info(f"... warmed up {count} buffers!")
+
     async def start(self, graceful: bool = True) -> None:
         """
         Start the engine.
@@ -145,21 +186,94 @@ class Engine:
         self.pattern_players.clear()
         logger.info("... engine stopped!")
 
+    @property
+    def analysis_engine(self) -> AnalysisEngine:
+        """
+        The first (and, by default, only) channel's analysis engine.
+        """
+        return self.analysis_engines[0]
+
     async def on_analysis_target(self, analysis_target: AnalysisTarget) -> None:
-        # Query the database
-        entries = self.database.query_analysis_target(analysis_target)
+        await self.on_analysis_targets([analysis_target])
+
+    async def on_analysis_targets(self, analysis_targets: List[AnalysisTarget]) -> None:
+        # Query the database, once for every channel
+        if self.config.buffer_budget_megabytes is None:
+            all_entries = self.database.query_analysis_targets(analysis_targets)
+        else:
+            # query extra candidates, so resident ones can substitute for others
+            all_entries = self.database.query_analysis_targets(
+                [dataclasses.replace(x, k=x.k * 2) for x in analysis_targets]
+            )
+        if (query_cache := self.database.query_cache) is not None:
+            logger.info(
+                f"Query cache hit rate: {query_cache.hit_rate:.1%} "
+                f"({query_cache.hits} hits, {query_cache.misses} misses, "
+                f"{query_cache.evictions} evictions)"
+            )
+        if self.buffer_manager.pool_size:
+            logger.info(
+                f"Buffer pool hit rate: {self.buffer_manager.hit_rate:.1%} "
+                f"({len(self.buffer_manager.pool)} pooled, "
+                f"{self.buffer_manager.evictions} evictions)"
+            )
+        # Play each channel's entries concurrently, as each may wait on buffers
+        await asyncio.gather(
+            *(
+                self.play_entries(analysis_target, entries)
+                for analysis_target, entries in zip(analysis_targets, all_entries)
+            )
+        )
+
+    async def play_entries(
+        self, analysis_target: AnalysisTarget, entries: List[Entry]
+    ) -> None:
         if not entries:
             logger.warning("No entries found")
+            return
         # Generate a UUID
         uuid = uuid4()
-        # Allocate buffers
-        logger.info(f"Allocating {len(entries)} buffers with {uuid}")
         async with self.provider.at():
+            # Admit entries within the memory budget, if any
+            admitted_entries = self.buffer_manager.admit(entries, analysis_target.k)
+            if self.buffer_manager.budget_megabytes is not None:
+                logger.info(
+                    f"Admitted {len(admitted_entries)} of {len(entries)} entries, "
+                    f"using {self.buffer_manager.megabytes:.1f} of "
+                    f"{self.buffer_manager.budget_megabytes:g} MB"
+                )
+            entries = admitted_entries
+            if not entries:
+                logger.warning("Rejected target: buffer memory budget exhausted")
+                return
+            self.database.record_entries(entries)
+            # Allocate buffers
+            logger.info(f"Allocating {len(entries)} buffers with {uuid}")
             buffers = self.buffer_manager.increment_multiple(entries, uuid)
+        regions = [self.buffer_manager.get_region(entry) for entry in entries]
+        if timeout := self.config.buffer_ready_timeout:
+            # Wait for buffers to be read, falling back to those already read
+            is_ready = await self.buffer_manager.wait_until_ready(buffers, timeout)
+            if not all(is_ready):
+                logger.warning(
+                    f"{is_ready.count(False)} of {len(buffers)} buffers "
+                    f"not ready after {timeout} seconds"
+                )
+                buffers = [x for x, ready in zip(buffers, is_ready) if ready]
+                regions = [x for x, ready in zip(regions, is_ready) if ready]
+            if not buffers:
+                async with self.provider.at():
+                    self.buffer_manager.decrement(uuid)
+                return
+            logger.debug(
+                f"Buffer read latency: "
+                f"p50 {self.buffer_manager.latencies.percentile(50):g}ms, "
+                f"p99 {self.buffer_manager.latencies.percentile(99):g}ms"
+            )
         logger.info("Emitting pattern...")
         # Generate the pattern
         pattern = self.pattern_factory.emit(
-            analysis_target, buffers, out=self.config.output_bus
+            analysis_target, buffers, out=self.config.output_bus, regions=regions
         )
         # Play it
         self.pattern_players[uuid] = pattern.play(
@@ -175,30 +289,23 @@ class Engine:
 
     async def on_analysis_osc_message(self, osc_message: OscMessage):
         logger.debug(f"/analysis received: {osc_message!r}")
-        (
-            _,
-            _,
-            peak,
-            rms,
-            f0,
-            is_voiced,
-            is_onset,
-            centroid,
-            flatness,
-            rolloff,
-            *mfcc,
-        ) = osc_message.contents
-        self.analysis_engine.intake(
-            peak=peak,
-            rms=rms,
-            f0=f0,
-            is_voiced=bool(is_voiced),
-            is_onset=bool(is_onset),
-            centroid=centroid,
-            flatness=flatness,
-            rolloff=rolloff,
-            mfcc=mfcc,
-        )
+        # node ID and reply ID, then one or more frames of features
+        node_id = osc_message.contents[0]
+        if (analysis_engine := self.analysis_engines_by_node_id.get(node_id)) is None:
+            logger.warning(f"/analysis received from unknown node {node_id}")
+            return
+        if analysis_engine.intake_many(
+            numpy.reshape(
+                osc_message.contents[2:], (self.config.analysis_batch_size, -1)
+            )
+        ):
+            channel = self.analysis_engines.index(analysis_engine)
+            logger.debug(f"Analysis triggered on channel {channel}")
+            self.analysis_triggers[channel].set()
+
+    async def on_done_osc_message(self, osc_message: OscMessage):
+        logger.debug(f"/done received: {osc_message!r}")
+        self.buffer_manager.on_done(osc_message.contents[1])
 
     async def on_n_end_osc_message(self, osc_message: OscMessage):
         logger.debug(f"/n_end received: {osc_message!r}")
@@ -226,21 +333,68 @@ class Engine:
             self.pattern_players.pop(player.uuid)
             self.pattern_futures.pop(player.uuid).set_result(True)
 
+    @property
+    def is_event_driven(self) -> bool:
+        return (
+            self.config.trigger_on_onsets
+            or self.config.trigger_rms_threshold is not None
+        )
+
     async def poll_analysis_engine(self) -> None:
         logger.info("Starting new analysis engine poller ...")
+        # poll every channel, unless only some channels triggered
+        channels = list(range(len(self.analysis_engines)))
         while self.is_running:
             # status = " ".join([x.strip() for x in repr(self.server.status).split()])
             # logger.info(status)
-            logger.info("Polling analysis engine ...")
-            analysis_target, min_sleep, max_sleep = self.analysis_engine.emit()
-            if analysis_target is not None:
-                # TODO: check if polyphony has capacity
-                if len(self.pattern_futures) > self.config.polyphony:
+            logger.info(f"Polling analysis engines {channels} ...")
+            emissions = [self.analysis_engines[channel].emit() for channel in channels]
+            analysis_targets = []
+            for channel, (analysis_target, _, _) in zip(channels, emissions):
+                if analysis_target is None:
+                    logger.info(f"Analysis engine {channel} not yet primed")
+                else:
+                    analysis_targets.append(analysis_target)
+            # poll as often as the most demanding channel wants
+            min_sleep = min(x[1] for x in emissions)
+            max_sleep = min(x[2] for x in emissions)
+            if analysis_targets:
+                capacity = self.config.polyphony - len(self.pattern_futures)
+                if capacity <= 0:
                     logger.warning(f"Too many patterns: {len(self.pattern_futures)}")
                 else:
                     logger.info(f"Sufficient patterns: {len(self.pattern_futures)}")
-                    await self.on_analysis_target(analysis_target)
-            else:
-                logger.info("Analysis engine not yet primed")
-            await asyncio.sleep(scale(random.random(), 0, 1, min_sleep, max_sleep))
+                    await self.on_analysis_targets(analysis_targets[:capacity])
+            sleep = scale(random.random(), 0, 1, min_sleep, max_sleep)
+            if not self.is_event_driven:
+                await asyncio.sleep(sleep)
+                continue
+            # rate-limit triggers, then wait on one, falling back to polling
+            cooldown = min(self.config.trigger_cooldown, sleep)
+            await asyncio.sleep(cooldown)
+            channels = await self.wait_for_analysis_triggers(sleep - cooldown)
         logger.info("... exiting analysis engine poller.")
+
+    async def wait_for_analysis_triggers(self, timeout: float) -> List[int]:
+        """
+        Wait for any channel to trigger, returning the triggered channels, or
+        every channel if none triggered before the timeout.
+        """
+        waiters = [
+            asyncio.get_running_loop().create_task(x.wait())
+            for x in self.analysis_triggers
+        ]
+        try:
+            await asyncio.wait(
+                waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+        channels = [i for i, x in enumerate(self.analysis_triggers) if x.is_set()]
+        for analysis_trigger in self.analysis_triggers:
+            analysis_trigger.clear()
+        if channels:
+            logger.info(f"Triggered analysis engines {channels} ...")
+            return channels
+        return list(range(len(self.analysis_engines)))
@@ -0,0 +1,299 @@
+import dataclasses
+import logging
+import math
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy
+from scipy.spatial import KDTree
+
+from .utils import timer
+
+logger = logging.getLogger(__name__)
+
+
+class Index:
+    """
+    A nearest-neighbor index over an (N x d) matrix of points.
+    """
+
+    @property
+    def dimension(self) -> int:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def query(
+        self, points: numpy.ndarray, k: int
+    ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Query the ``k`` nearest neighbors of each of an (M x d) matrix of points.
+
+        Returns (M x k) matrices of distances and indices, nearest first. Missing
+        neighbors have infinite distances, and are indexed past the end of the
+        data, as with SciPy's ``KDTree``.
+        """
+        raise NotImplementedError
+
+
+@dataclasses.dataclass
+class KDTreeIndex(Index):
+    """
+    An exact index.
+    """
+
+    kdtree: KDTree
+
+    @classmethod
+    def new(cls, points: numpy.ndarray) -> "KDTreeIndex":
+        return cls(kdtree=KDTree(points))
+
+    @property
+    def dimension(self) -> int:
+        return self.kdtree.m
+
+    def __len__(self) -> int:
+        return self.kdtree.n
+
+    def query(
+        self, points: numpy.ndarray, k: int
+    ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        # a list of ranks keeps results 2-d, even for k=1
+        return self.kdtree.query(points, k=list(range(1, k + 1)), workers=-1)
+
+
+@dataclasses.dataclass
+class IVFIndex(Index):
+    """
+    An approximate, inverted file index.
+
+    Points are clustered by k-means into lists. Queries only search the points
+    in the ``probe_count`` lists with the nearest centroids, trading recall for
+    speed as ``probe_count`` shrinks relative to the number of lists.
+    """
+
+    centroids: numpy.ndarray  # (L x d)
+    points: numpy.ndarray  # (N x d), grouped by list
+    indices: numpy.ndarray  # (N,) original index of each grouped point
+    offsets: numpy.ndarray  # (L + 1,) where each list starts in the points
+    probe_count: int = 8
+
+    @classmethod
+    def new(
+        cls,
+        points: numpy.ndarray,
+        list_count: Optional[int] = None,
+        probe_count: int = 8,
+        iterations: int = 10,
+        seed: int = 0,
+    ) -> "IVFIndex":
+        points = numpy.ascontiguousarray(points, dtype=numpy.float32)
+        if list_count is None:
+            list_count = int(4 * math.sqrt(len(points)))
+        list_count = max(min(list_count, len(points)), 1)
+        with timer() as t:
+            centroids = cls.train(points, list_count, iterations, seed)
+            assignments = cls.assign(points, centroids)
+            order = numpy.argsort(assignments, kind="stable")
+            offsets = numpy.zeros(list_count + 1, dtype=numpy.int64)
+            numpy.cumsum(
+                numpy.bincount(assignments, minlength=list_count), out=offsets[1:]
+            )
+            logger.info(
+                f"Built {list_count}-list index of {len(points)} points "
+                f"in {t():.4f} seconds"
+            )
+        return cls(
+            centroids=centroids,
+            points=points[order],
+            indices=order,
+            offsets=offsets,
+            probe_count=probe_count,
+        )
+
+    @staticmethod
+    def assign(points: numpy.ndarray, centroids: numpy.ndarray) -> numpy.ndarray:
+        """
+        Find the nearest centroid of each point, in memory-bounded chunks.
+        """
+        assignments = numpy.empty(len(points), dtype=numpy.int64)
+        squared_norms = (centroids**2).sum(axis=1)
+        chunk_size = max(2**24 // len(centroids), 1)
+        for start in range(0, len(points), chunk_size):
+            stop = min(start + chunk_size, len(points))
+            # |x - c|^2 ranks the same as |c|^2 - 2x.c
+            assignments[start:stop] = numpy.argmin(
+                squared_norms - 2 * points[start:stop] @ centroids.T, axis=1
+            )
+        return assignments
+
+    @classmethod
+    def train(
+        cls, points: numpy.ndarray, list_count: int, iterations: int, seed: int
+    ) -> numpy.ndarray:
+        """
+        Cluster a sample of the points with Lloyd's algorithm.
+        """
+        rng = numpy.random.default_rng(seed)
+        sample_size = min(len(points), 64 * list_count)
+        sample = points[numpy.sort(rng.choice(len(points), sample_size, replace=False))]
+        centroids = sample[rng.choice(sample_size, list_count, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = cls.assign(sample, centroids)
+            counts = numpy.bincount(assignments, minlength=list_count)
+            sums = numpy.stack(
+                [
+                    numpy.bincount(assignments, weights=column, minlength=list_count)
+                    for column in sample.T
+                ],
+                axis=1,
+            )
+            # empty lists keep their previous centroid
+            nonempty = counts > 0
+            centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+        return centroids
+
+    @property
+    def dimension(self) -> int:
+        return self.points.shape[1]
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def query(
+        self, points: numpy.ndarray, k: int, probe_count: Optional[int] = None
+    ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        points = numpy.atleast_2d(numpy.asarray(points, dtype=numpy.float32))
+        probe_count = min(probe_count or self.probe_count, len(self.centroids))
+        distances = numpy.full((len(points), k), numpy.inf)
+        indices = numpy.full((len(points), k), len(self), dtype=numpy.int64)
+        centroid_distances = (self.centroids**2).sum(
+            axis=1
+        ) - 2 * points @ self.centroids.T
+        if probe_count < len(self.centroids):
+            probes = numpy.argpartition(centroid_distances, probe_count - 1, axis=1)
+        else:
+            probes = numpy.broadcast_to(
+                numpy.arange(len(self.centroids)), centroid_distances.shape
+            )
+        starts, stops = self.offsets[:-1], self.offsets[1:]
+        for i, point in enumerate(points):
+            lists = probes[i, :probe_count]
+            candidates = numpy.concatenate(
+                [numpy.arange(starts[x], stops[x]) for x in lists]
+            )
+            candidate_distances = ((self.points[candidates] - point) ** 2).sum(axis=1)
+            count = min(k, len(candidates))
+            if count < len(candidates):
+                nearest = numpy.argpartition(candidate_distances, count - 1)[:count]
+            else:
+                nearest = numpy.arange(len(candidates))
+            nearest = nearest[numpy.argsort(candidate_distances[nearest])]
+            distances[i, :count] = numpy.sqrt(candidate_distances[nearest])
+            indices[i, :count] = self.indices[candidates[nearest]]
+        return distances, indices
+
+
+@dataclasses.dataclass
+class BucketedIndex(Index):
+    """
+    Sub-indexes of points bucketed by pitch: one per octave of voiced points and
+    one of unvoiced points.
+
+    Queries search their own pitch's bucket. Sparse voiced buckets widen to the
+    nearest octaves until at least ``minimum_size`` points are searched, and
+    sparse unvoiced buckets fall back to searching every bucket.
+    """
+
+    buckets: Dict[int, Index]
+    indices: Dict[int, numpy.ndarray]  # original index of each bucketed point
+    minimum_size: int = 100
+
+    UNVOICED = -1
+
+    @classmethod
+    def new(
+        cls,
+        points: numpy.ndarray,
+        f0: numpy.ndarray,
+        new_index: Callable[[numpy.ndarray], Index],
+        minimum_size: int = 100,
+    ) -> "BucketedIndex":
+        with timer() as t:
+            keys = cls.get_buckets(f0)
+            buckets, indices = {}, {}
+            for key in numpy.unique(keys).tolist():
+                indices[key] = numpy.flatnonzero(keys == key)
+                buckets[key] = new_index(points[indices[key]])
+            logger.info(
+                f"Built {len(buckets)} pitch buckets of "
+                f"{[len(x) for x in indices.values()]} points in {t():.4f} seconds"
+            )
+        return cls(buckets=buckets, indices=indices, minimum_size=minimum_size)
+
+    @classmethod
+    def get_buckets(cls, f0: numpy.ndarray) -> numpy.ndarray:
+        """
+        Bucket MIDI pitches by octave, and unvoiced (negative) pitches together.
+        """
+        f0 = numpy.asarray(f0, dtype=numpy.float64)
+        return numpy.where(f0 < 0, cls.UNVOICED, numpy.floor(f0 / 12)).astype(int)
+
+    @property
+    def dimension(self) -> int:
+        return next(iter(self.buckets.values())).dimension
+
+    def __len__(self) -> int:
+        return sum(len(x) for x in self.indices.values())
+
+    def get_plan(self, key: int, k: int) -> List[int]:
+        """
+        Get the buckets to search for a query in bucket ``key``.
+        """
+        minimum_size = max(k, self.minimum_size)
+        sizes = {x: len(y) for x, y in self.indices.items()}
+        if key == self.UNVOICED:
+            if sizes.get(key, 0) >= minimum_size:
+                return [key]
+            return sorted(sizes)
+        plan, size = [], 0
+        voiced_keys = [x for x in sizes if x != self.UNVOICED]
+        for voiced_key in sorted(voiced_keys, key=lambda x: (abs(x - key), x)):
+            plan.append(voiced_key)
+            if (size := size + sizes[voiced_key]) >= minimum_size:
+                return plan
+        return sorted(sizes)
+
+    def query(
+        self, points: numpy.ndarray, k: int, f0: Optional[numpy.ndarray] = None
+    ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Query points, bucketed by their (unweighted, unwhitened) ``f0``.
+
+        Without ``f0``, every bucket is searched.
+        """
+        points = numpy.atleast_2d(points)
+        if f0 is None:
+            keys = numpy.zeros(len(points), dtype=int)
+        else:
+            keys = self.get_buckets(f0)
+        distances = numpy.full((len(points), k), numpy.inf)
+        indices = numpy.full((len(points), k), len(self), dtype=numpy.int64)
+        for key in numpy.unique(keys).tolist():
+            mask = keys == key
+            plan = self.get_plan(key, k) if f0 is not None else sorted(self.buckets)
+            all_distances, all_indices = [], []
+            for bucket_key in plan:
+                bucket_distances, bucket_indices = self.buckets[bucket_key].query(
+                    points[mask], k
+                )
+                # map back to original indices, keeping missing neighbors missing
+                bucket_map = numpy.append(self.indices[bucket_key], len(self))
+                all_distances.append(bucket_distances)
+                all_indices.append(bucket_map[bucket_indices])
+            merged_distances = numpy.concatenate(all_distances, axis=1)
+            merged_indices = numpy.concatenate(all_indices, axis=1)
+            order = numpy.argsort(merged_distances, axis=1, kind="stable")[:, :k]
+            distances[mask] = numpy.take_along_axis(merged_distances, order, axis=1)
+            indices[mask] = numpy.take_along_axis(merged_indices, order, axis=1)
+        return distances, indices
@@ -1,35 +1,77 @@
 import random
-from typing import List
+from typing import List, Optional, Tuple
 
-from supriya.patterns import ChoicePattern, EventPattern, Pattern, RandomPattern
+from supriya.patterns import (
+    ChoicePattern,
+    EventPattern,
+    Pattern,
+    RandomPattern,
+    SequencePattern,
+    UpdatePattern,
+)
 from supriya.providers import BufferProxy
 
 from .analysis import AnalysisTarget, PatternFlavor
 from .synthdefs import granulate, playback, warp
 
+Region = Tuple[float, float]
+
 
 class PatternFactory:
     def emit(
-        self, analysis_target: AnalysisTarget, buffers: List[BufferProxy], out: int = 0
+        self,
+        analysis_target: AnalysisTarget,
+        buffers: List[BufferProxy],
+        out: int = 0,
+        regions: Optional[List[Region]] = None,
     ) -> Pattern:
+        """
+        Emit a pattern playing buffers.
+
+        Each buffer may be paired with the region of it to play, as a start and
+        length relative to the whole buffer.
+        """
         if not buffers:
             raise ValueError
+        if regions is None:
+            regions = [(0.0, 1.0)] * len(buffers)
+        if len(regions) != len(buffers):
+            raise ValueError
         return {
             PatternFlavor.BASIC: self.emit_basic_pattern,
             PatternFlavor.GRANULATE: self.emit_granulate_pattern,
             PatternFlavor.WARP: self.emit_warp_pattern,
-        }[analysis_target.pattern_flavor](analysis_target, buffers, out)
+        }[analysis_target.pattern_flavor](analysis_target, buffers, regions, out)
+
+    def emit_buffer_pattern(
+        self, buffers: List[BufferProxy], regions: List[Region], iterations: int
+    ) -> Pattern:
+        """
+        Choose buffers, each along with its region.
+        """
+        return ChoicePattern(
+            sequence=[
+                EventPattern(
+                    buffer_id=SequencePattern([buffer_]),
+                    region_length=region_length,
+                    region_start=region_start,
+                )
+                for buffer_, (region_start, region_length) in zip(buffers, regions)
+            ],
+            forbid_repetitions=True,
+            iterations=iterations,
+        )
 
     def emit_basic_pattern(
-        self, analysis_target: AnalysisTarget, buffers: List[BufferProxy], out: int = 0
+        self,
+        analysis_target: AnalysisTarget,
+        buffers: List[BufferProxy],
+        regions: List[Region],
+        out: int = 0,
     ) -> Pattern:
-        return EventPattern(
+        return UpdatePattern(
+            self.emit_buffer_pattern(buffers, regions, random.randint(5, 25)),
             synthdef=playback,
-            buffer_id=ChoicePattern(
-                sequence=buffers,
-                forbid_repetitions=True,
-                iterations=random.randint(5, 25),
-            ),
             delta=RandomPattern(0.0, 0.25),
             duration=0.0,
             gain=RandomPattern(-24, 0),
@@ -39,15 +81,15 @@ class PatternFactory:
         )
 
     def emit_granulate_pattern(
-        self, analysis_target: AnalysisTarget, buffers: List[BufferProxy], out: int = 0
+        self,
+        analysis_target: AnalysisTarget,
+        buffers: List[BufferProxy],
+        regions: List[Region],
+        out: int = 0,
     ) -> Pattern:
-        return EventPattern(
+        return UpdatePattern(
+            self.emit_buffer_pattern(buffers, regions, random.randint(1, 3)),
             synthdef=granulate,
-            buffer_id=ChoicePattern(
-                sequence=buffers,
-                forbid_repetitions=True,
-                iterations=random.randint(1, 3),
-            ),
             delta=RandomPattern(0.0, 2.0),
             duration=0.0,
             gain=RandomPattern(-24, 0),
@@ -57,15 +99,15 @@ class PatternFactory:
         )
 
     def emit_warp_pattern(
-        self, analysis_target: AnalysisTarget, buffers: List[BufferProxy], out: int = 0
+        self,
+        analysis_target: AnalysisTarget,
+        buffers: List[BufferProxy],
+        regions: List[Region],
+        out: int = 0,
     ) -> Pattern:
-        return EventPattern(
+        return UpdatePattern(
+            self.emit_buffer_pattern(buffers, regions, random.randint(1, 5)),
             synthdef=warp,
-            buffer_id=ChoicePattern(
-                sequence=buffers,
-                forbid_repetitions=True,
-                iterations=random.randint(1, 5),
-            ),
             delta=RandomPattern(0.0, 5.0),
             duration=0.0,
             gain=RandomPattern(-24, 0),
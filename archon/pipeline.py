@@ -7,19 +7,24 @@ import os
 import sys
 import tempfile
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Set, Tuple
 
 import numpy
 from joblib import Parallel, delayed
 from supriya import Session
 
 from .config import ArchonConfig
-from .synthdefs import build_offline_analysis_synthdef
+from .query import Database
+from .store import AnalysisStore, AnalysisStoreWriter
+from .synthdefs import build_offline_analysis_synthdef, offline_playback
 from .utils import timer
 
 logger = logging.getLogger(__name__)
 
+CACHE_VERSION = 2
+
 
 @dataclasses.dataclass
 class Analysis:
@@ -32,6 +37,7 @@ class Analysis:
     frame_length: int  # frame here is a spectral frame
     hop_length: int
     sample_rate: int
+    cache_key: Optional[str] = None
 
     @property
     def features(self):
@@ -73,19 +79,174 @@ class Partition:
     rolloff: float
 
 
-def describe_audio(path: Path) -> Tuple[int, float, int]:
-    import librosa
+@dataclasses.dataclass
+class PartitionedAnalysis:
+    """
+    The partitions and feature statistics of a single file, sans analysis array.
+    """
+
+    path: Path
+    cache_key: Optional[str]
+    statistics: Dict[str, List[float]]  # minimum, maximum, sum, count
+    partitions: List[Partition]
+    process_id: int = 0
+    elapsed: float = 0.0
+
+
+@dataclasses.dataclass(frozen=True)
+class AudioDescription:
+    """
+    Audio file properties, as read from its header.
+    """
+
+    sample_rate: int
+    frame_count: int  # frame here is a sample frame
+    channel_count: int
+
+    @property
+    def duration(self) -> float:
+        return self.frame_count / self.sample_rate
+
 
-    sample_rate = librosa.get_samplerate(path)
-    duration = librosa.get_duration(filename=path)
-    stream = librosa.stream(
-        path, block_length=1, frame_length=1024, hop_length=256, mono=False
+def describe_audio(path: Path) -> AudioDescription:
+    """
+    Describe an audio file from its header alone, without decoding any samples.
+    """
+    import soundfile
+
+    info = soundfile.info(str(path))
+    return AudioDescription(
+        sample_rate=info.samplerate,
+        frame_count=info.frames,
+        channel_count=info.channels,
     )
-    if len(shape := next(stream).shape) == 1:
-        channel_count = 1
-    else:
-        channel_count = shape[0]
-    return sample_rate, duration, channel_count
+
+
+def hash_file(path: Path, block_size: int = 2**20) -> str:
+    hasher = hashlib.sha256()
+    with path.open("rb") as file_pointer:
+        while block := file_pointer.read(block_size):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def hash_files(
+    cache_path: Path, paths: List[Path], job_count: int = 1
+) -> Dict[Path, str]:
+    """
+    Hash files' contents, rehashing only files whose size or modification time
+    changed since the digests last recorded in ``cache_path``.
+    """
+    digests_path = cache_path / "file-digests.json"
+    try:
+        recorded = json.loads(digests_path.read_text())
+    except (OSError, ValueError):
+        recorded = {}
+    stats = {path: path.stat() for path in paths}
+    digests: Dict[Path, str] = {}
+    for path, stat in stats.items():
+        size, mtime_ns, digest = recorded.get(str(path.resolve()), (None, None, None))
+        if (size, mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+            digests[path] = digest
+    if changed_paths := [path for path in paths if path not in digests]:
+        logger.info(f"Hashing {len(changed_paths)} new or modified files ...")
+        with ThreadPoolExecutor(max_workers=job_count) as executor:
+            digests.update(zip(changed_paths, executor.map(hash_file, changed_paths)))
+    cache_path.mkdir(parents=True, exist_ok=True)
+    # only current files are recorded, so deleted files drop out
+    digests_path.write_text(
+        json.dumps(
+            {
+                str(path.resolve()): (stat.st_size, stat.st_mtime_ns, digests[path])
+                for path, stat in stats.items()
+            },
+            sort_keys=True,
+        )
+    )
+    return digests
+
+
+def get_cache_key(
+    config: ArchonConfig,
+    path: Path,
+    frame_length: int = 2048,
+    hop_ratio: float = 0.5,
+    file_digest: Optional[str] = None,
+) -> str:
+    """
+    Key a file's analysis by its content and the settings it was analyzed with.
+
+    Pass ``file_digest``, as from ``hash_files``, to skip rehashing the file.
+    """
+    settings = dict(
+        analysis_backend=config.analysis_backend,
+        frame_length=frame_length,
+        hop_ratio=hop_ratio,
+        pitch_detection_max_frequency=config.pitch_detection_max_frequency,
+        pitch_detection_min_frequency=config.pitch_detection_min_frequency,
+        version=CACHE_VERSION,
+    )
+    if config.analysis_backend == "nrt":
+        # chunk boundaries reset the analysis UGens, so chunking changes output
+        settings.update(
+            nrt_chunk_duration=config.nrt_chunk_duration,
+            nrt_chunk_overlap=config.nrt_chunk_overlap,
+        )
+    hasher = hashlib.sha256()
+    hasher.update((file_digest or hash_file(path)).encode())
+    hasher.update(json.dumps(settings, sort_keys=True).encode())
+    return hasher.hexdigest()
+
+
+def load_cached_analysis(
+    cache_path: Path, cache_key: str, relative_path: Path
+) -> Optional[Analysis]:
+    if not (file_path := cache_path / f"{cache_key}.npz").exists():
+        return None
+    try:
+        with numpy.load(file_path) as data:
+            return Analysis(
+                path=relative_path,
+                array=data["array"],
+                frame_length=int(data["frame_length"]),
+                hop_length=int(data["hop_length"]),
+                sample_rate=int(data["sample_rate"]),
+                cache_key=cache_key,
+            )
+    except Exception:
+        logger.warning(f"Discarding unreadable cache entry {file_path}")
+        file_path.unlink(missing_ok=True)
+        return None
+
+
+def save_cached_analysis(cache_path: Path, analysis: Analysis) -> None:
+    cache_path.mkdir(parents=True, exist_ok=True)
+    # write-then-rename, so concurrent workers never observe partial files
+    with tempfile.NamedTemporaryFile(
+        dir=cache_path, suffix=".tmp", delete=False
+    ) as file_pointer:
+        numpy.savez(
+            file_pointer,
+            array=analysis.array,
+            frame_length=analysis.frame_length,
+            hop_length=analysis.hop_length,
+            sample_rate=analysis.sample_rate,
+        )
+    os.replace(file_pointer.name, cache_path / f"{analysis.cache_key}.npz")
+
+
+def prune_cache(cache_path: Path, cache_keys: Set[str]) -> int:
+    """
+    Remove cached analyses not in ``cache_keys``, e.g. of deleted or modified files.
+    """
+    if not cache_path.exists():
+        return 0
+    pruned_count = 0
+    for file_path in cache_path.iterdir():
+        if file_path.suffix in (".npz", ".tmp") and file_path.stem not in cache_keys:
+            file_path.unlink(missing_ok=True)
+            pruned_count += 1
+    return pruned_count
 
 
 def analyze(
@@ -96,26 +257,52 @@ def analyze(
     setup_logging: bool = False,
     frame_length: int = 2048,
     hop_ratio: float = 0.5,
+    cache_path: Optional[Path] = None,
+    description: Optional[AudioDescription] = None,
+    file_digest: Optional[str] = None,
 ) -> Optional[Analysis]:
     """
     Analyze a single file.
+
+    If ``cache_path`` is given, reuse a previous analysis of identical content
+    and settings, or store the new analysis there. Pass ``description`` to skip
+    re-probing the file, and ``file_digest`` to skip rehashing it.
     """
     if setup_logging:
         logging.basicConfig()
         logging.getLogger("archon").setLevel(logging.INFO)
     relative_path = path.relative_to(config.root_path)
+    cache_key = None
+    if cache_path is not None:
+        cache_key = get_cache_key(
+            config,
+            path,
+            frame_length=frame_length,
+            hop_ratio=hop_ratio,
+            file_digest=file_digest,
+        )
+        if analysis := load_cached_analysis(cache_path, cache_key, relative_path):
+            logger.info(
+                f"[{path_index: >3}/{path_count: >3}] "
+                f"Loaded {relative_path} from cache"
+            )
+            return analysis
     logger.info(f"[{path_index: >3}/{path_count: >3}] Analyzing {relative_path} ...")
-    sample_rate, duration, _ = describe_audio(path)
-    logger.info
+    if description is None:
+        description = describe_audio(path)
     try:
         with timer() as t:
-            array, adjusted_frame_length = analyze_via_nrt(
+            array, adjusted_frame_length = {
+                "librosa": analyze_via_librosa,
+                "nrt": analyze_via_nrt,
+            }[config.analysis_backend](
                 config=config,
                 path=config.root_path / path,
                 frame_length=frame_length,
                 hop_ratio=hop_ratio,
                 path_index=path_index,
                 path_count=path_count,
+                description=description,
             )
             assert array.shape[0] == 50, array.shape
             analysis = Analysis(
@@ -123,8 +310,11 @@ def analyze(
                 array=array,
                 frame_length=adjusted_frame_length,
                 hop_length=int(adjusted_frame_length * hop_ratio),
-                sample_rate=sample_rate,
+                sample_rate=description.sample_rate,
+                cache_key=cache_key,
             )
+            if cache_path is not None:
+                save_cached_analysis(cache_path, analysis)
             logger.info(
                 f"[{path_index: >3}/{path_count: >3}] ... "
                 f"Analyzed {relative_path} in {t():.3f} seconds"
@@ -136,6 +326,154 @@ def analyze(
         return None
 
 
+def get_job_count(config: ArchonConfig) -> int:
+    """
+    Get the number of concurrent workers, defaulting to half the CPUs.
+
+    Budgets are clamped to between one worker and one worker per CPU.
+    """
+    cpu_count = os.cpu_count() or 4
+    if config.cpu_budget is None:
+        return max(cpu_count // 2, 1)
+    return min(max(config.cpu_budget, 1), cpu_count)
+
+
+def get_frame_geometry(
+    sample_rate: int, duration: float, frame_length: int = 2048, hop_ratio: float = 0.5
+) -> Tuple[int, float, int]:
+    """
+    Get the adjusted frame length, hop length and frame count for analyzing audio.
+
+    Frame lengths scale with sample rates at multiples of 44.1kHz.
+    """
+    if sample_rate >= 44100:
+        sample_rate_ratio = sample_rate // 44100
+    else:
+        sample_rate_ratio = 1
+    adjusted_frame_length = frame_length * sample_rate_ratio
+    hop_length = adjusted_frame_length * hop_ratio
+    frame_count = int(duration * sample_rate / hop_length)
+    return adjusted_frame_length, hop_length, frame_count
+
+
+def compute_clarity(
+    audio: numpy.ndarray,
+    f0: numpy.ndarray,
+    sample_rate: int,
+    frame_length: int,
+    hop_length: int,
+) -> numpy.ndarray:
+    """
+    Compute each centered frame's normalized autocorrelation at its f0's period.
+
+    Periodic frames score near 1, and noisy frames near 0.
+    """
+    import librosa
+
+    frames = librosa.util.frame(
+        numpy.pad(audio, frame_length // 2),
+        frame_length=frame_length,
+        hop_length=hop_length,
+    )
+    lags = numpy.clip(numpy.round(sample_rate / f0).astype(int), 1, frame_length - 1)
+    clarity = numpy.zeros(min(frames.shape[1], len(f0)), dtype=numpy.float32)
+    for i, lag in enumerate(lags[: len(clarity)]):
+        head, tail = frames[:-lag, i], frames[lag:, i]
+        energy = numpy.sqrt(numpy.dot(head, head) * numpy.dot(tail, tail))
+        if energy > 0:
+            clarity[i] = numpy.dot(head, tail) / energy
+    return clarity
+
+
+def analyze_via_librosa(
+    config: ArchonConfig,
+    path: Path,
+    *,
+    frame_length: int = 2048,
+    hop_ratio: float = 0.5,
+    path_index: int = 1,
+    path_count: int = 1,
+    description: Optional[AudioDescription] = None,
+) -> Tuple[numpy.ndarray, int]:
+    """
+    Analyze in-process, with the same frames and features as NRT analysis.
+
+    Features approximate, rather than reproduce, their scsynth UGen equivalents,
+    so analyses from different backends shouldn't be mixed in one corpus.
+    """
+    import librosa
+
+    if description is None:
+        description = describe_audio(path)
+    sample_rate = description.sample_rate
+    adjusted_frame_length, hop_length, frame_count = get_frame_geometry(
+        sample_rate,
+        description.duration,
+        frame_length=frame_length,
+        hop_ratio=hop_ratio,
+    )
+    hop_length = int(hop_length)
+    logger.info(f"[{path_index: >3}/{path_count: >3}] ... Analyzing via librosa ...")
+    # NRT analysis only reads the first channel
+    audio, _ = librosa.load(path, sr=sample_rate, mono=False, dtype=numpy.float32)
+    if audio.ndim > 1:
+        audio = audio[0]
+    magnitudes = numpy.abs(
+        librosa.stft(audio, n_fft=adjusted_frame_length, hop_length=hop_length)
+    )
+    peak = librosa.util.frame(
+        numpy.pad(numpy.abs(audio), (0, hop_length)),
+        frame_length=hop_length,
+        hop_length=hop_length,
+    ).max(axis=0)
+    rms = librosa.feature.rms(
+        S=magnitudes, frame_length=adjusted_frame_length, hop_length=hop_length
+    )[0]
+    # yin is an order of magnitude faster than pyin, which would dominate
+    f0 = librosa.yin(
+        audio,
+        fmin=config.pitch_detection_min_frequency,
+        fmax=config.pitch_detection_max_frequency,
+        sr=sample_rate,
+        frame_length=adjusted_frame_length,
+        hop_length=hop_length,
+    )
+    # like Pitch, frames are voiced when loud and periodic enough
+    clarity = compute_clarity(audio, f0, sample_rate, adjusted_frame_length, hop_length)
+    is_voiced = ((rms >= 0.01) & (clarity >= 0.5)).astype(numpy.float32)
+    is_onset = numpy.zeros(magnitudes.shape[-1], dtype=numpy.float32)
+    is_onset[
+        librosa.onset.onset_detect(
+            y=audio, sr=sample_rate, hop_length=hop_length, units="frames"
+        )
+    ] = 1.0
+    mfcc = librosa.feature.mfcc(
+        S=librosa.power_to_db(
+            librosa.feature.melspectrogram(S=magnitudes**2, sr=sample_rate)
+        ),
+        n_mfcc=42,
+    )
+    with numpy.errstate(divide="ignore"):
+        features = [
+            librosa.amplitude_to_db(peak, ref=1.0, amin=1e-12, top_db=None),
+            librosa.amplitude_to_db(rms, ref=1.0, amin=1e-12, top_db=None),
+            librosa.hz_to_midi(f0),
+            is_voiced,
+            is_onset,
+            librosa.feature.spectral_centroid(S=magnitudes, sr=sample_rate)[0],
+            librosa.feature.spectral_flatness(S=magnitudes)[0],
+            librosa.feature.spectral_rolloff(
+                S=magnitudes, sr=sample_rate, roll_percent=0.5
+            )[0],
+            *mfcc,
+        ]
+    array = numpy.zeros((len(features), frame_count), dtype=numpy.float32)
+    for i, feature in enumerate(features):
+        count = min(len(feature), frame_count)
+        array[i, :count] = feature[:count]
+    return array, adjusted_frame_length
+
+
 def analyze_via_nrt(
     config: ArchonConfig,
     path: Path,
@@ -144,20 +482,65 @@ def analyze_via_nrt(
     hop_ratio: float = 0.5,
     path_index: int = 1,
     path_count: int = 1,
+    description: Optional[AudioDescription] = None,
 ) -> Tuple[numpy.ndarray, int]:
+    """
+    Analyze a file by rendering the offline analysis synthdef in scsynth NRT.
+
+    Files longer than the configured chunk duration are split into chunks,
+    rendered concurrently and stitched back together.
+    """
+    if description is None:
+        description = describe_audio(path)
+    adjusted_frame_length, hop_length, frame_count = get_frame_geometry(
+        description.sample_rate,
+        description.duration,
+        frame_length=frame_length,
+        hop_ratio=hop_ratio,
+    )
+    chunk_duration = config.nrt_chunk_duration
+    render = (
+        render_nrt_chunks
+        if chunk_duration and description.duration > chunk_duration
+        else render_nrt
+    )
+    analysis = render(
+        config,
+        path,
+        description,
+        frame_count,
+        frame_length=adjusted_frame_length,
+        hop_ratio=hop_ratio,
+        path_index=path_index,
+        path_count=path_count,
+    )
+    return analysis, adjusted_frame_length
+
+
+def render_nrt(
+    config: ArchonConfig,
+    path: Path,
+    description: AudioDescription,
+    frame_count: int,
+    *,
+    frame_length: int,
+    hop_ratio: float,
+    path_index: int = 1,
+    path_count: int = 1,
+    starting_frame: Optional[int] = None,
+) -> numpy.ndarray:
+    """
+    Render ``frame_count`` analysis frames of a file in a single NRT session.
+
+    If ``starting_frame`` is given, scsynth reads the file from that sample
+    frame into a buffer and plays it back, instead of using it as NRT input.
+    """
     import librosa
 
-    sample_rate, duration, channel_count = describe_audio(path)
-    if sample_rate >= 44100:
-        sample_rate_ratio = sample_rate // 44100
-    else:
-        sample_rate_ratio = 1
-    adjusted_frame_length = frame_length * sample_rate_ratio
-    hop_length = adjusted_frame_length * hop_ratio
-    frame_count = int(duration * sample_rate / hop_length)
-    analysis_duration = frame_count * hop_length / sample_rate
+    sample_rate = description.sample_rate
+    analysis_duration = frame_count * frame_length * hop_ratio / sample_rate
     synthdef = build_offline_analysis_synthdef(
-        frame_length=adjusted_frame_length,
+        frame_length=frame_length,
         hop_ratio=hop_ratio,
         pitch_detection_max_frequency=config.pitch_detection_max_frequency,
         pitch_detection_min_frequency=config.pitch_detection_min_frequency,
@@ -168,33 +551,173 @@ def analyze_via_nrt(
             f"... Rendering analysis in {temp_directory} ..."
         )
         output_path = Path(temp_directory) / "analysis.wav"
-        session = Session(
-            input_=path.resolve(),
-            input_bus_channel_count=channel_count,
-            output_bus_channel_count=1,  # can't currently just write to /dev/null
-        )
+        if starting_frame is None:
+            session = Session(
+                input_=path.resolve(),
+                input_bus_channel_count=description.channel_count,
+                output_bus_channel_count=1,  # can't currently just write to /dev/null
+            )
+        else:
+            session = Session(input_bus_channel_count=0, output_bus_channel_count=1)
         with session.at(0):
             output_buffer = session.add_buffer(
                 channel_count=42 + 8, frame_count=frame_count
             )
-            session.add_synth(
+            if starting_frame is None:
+                in_ = session.audio_input_bus_group
+            else:
+                in_ = session.add_bus_group(calculation_rate="audio")
+            analysis_synth = session.add_synth(
                 synthdef=synthdef,
-                in_=session.audio_input_bus_group,
+                in_=in_,
                 output_buffer_id=output_buffer,
                 duration=analysis_duration,
             )
+            if starting_frame is not None:
+                # like the NRT input bus, only the first channel is analyzed
+                input_buffer = session.add_buffer(
+                    channel_count=1,
+                    file_path=path.resolve(),
+                    frame_count=min(
+                        round(analysis_duration * sample_rate),
+                        description.frame_count - starting_frame,
+                    ),
+                    starting_frame=starting_frame,
+                )
+                # play back ahead of the analysis synth, so it reads this block
+                analysis_synth.add_synth(
+                    add_action="ADD_BEFORE",
+                    synthdef=offline_playback,
+                    buffer_id=input_buffer,
+                    duration=analysis_duration,
+                    out=in_,
+                )
         with session.at(analysis_duration):
             output_buffer.write(
                 file_path=output_path, header_format="WAV", sample_format="FLOAT"
             )
         session.render(render_directory_path=temp_directory, sample_rate=sample_rate)
         analysis, _ = librosa.load(output_path, sr=sample_rate, mono=False)
-    return analysis, adjusted_frame_length
+    return analysis
+
+
+def get_chunks(
+    frame_count: int, chunk_frame_count: int, overlap_frame_count: int
+) -> List[Tuple[int, int, int]]:
+    """
+    Split ``frame_count`` analysis frames into chunks.
+
+    Each chunk is a ``(start_frame, stop_frame, preroll)`` triple, where
+    ``preroll`` is the number of frames before ``start_frame`` to render and
+    discard, so that stateful analysis UGens settle before the frames kept.
+    """
+    chunks = []
+    for start_frame in range(0, frame_count, max(chunk_frame_count, 1)):
+        stop_frame = min(start_frame + chunk_frame_count, frame_count)
+        chunks.append((start_frame, stop_frame, min(overlap_frame_count, start_frame)))
+    return chunks
 
 
-def hash_array(array):
-    u = array.view("u" + str(array.itemsize))
-    return numpy.bitwise_xor.reduce(u.ravel())
+def render_nrt_chunks(
+    config: ArchonConfig,
+    path: Path,
+    description: AudioDescription,
+    frame_count: int,
+    *,
+    frame_length: int,
+    hop_ratio: float,
+    path_index: int = 1,
+    path_count: int = 1,
+) -> numpy.ndarray:
+    """
+    Render a long file as overlapping chunks, concurrently.
+
+    Chunk boundaries fall on whole hops, so chunk ``i`` of the stitched array
+    lines up with the frames a single render would have produced.
+    """
+    hop_length = int(frame_length * hop_ratio)
+    sample_rate = description.sample_rate
+    chunks = get_chunks(
+        frame_count,
+        math.ceil(config.nrt_chunk_duration * sample_rate / hop_length),
+        math.ceil(config.nrt_chunk_overlap * sample_rate / hop_length),
+    )
+    logger.info(
+        f"[{path_index: >3}/{path_count: >3}] "
+        f"... Rendering {frame_count} frames in {len(chunks)} chunks ..."
+    )
+
+    def render_chunk(chunk: Tuple[int, int, int]) -> numpy.ndarray:
+        start_frame, stop_frame, preroll = chunk
+        analysis = render_nrt(
+            config,
+            path,
+            description,
+            stop_frame - start_frame + preroll,
+            frame_length=frame_length,
+            hop_ratio=hop_ratio,
+            path_index=path_index,
+            path_count=path_count,
+            starting_frame=(start_frame - preroll) * hop_length,
+        )
+        stop = preroll + stop_frame - start_frame
+        return analysis[:, preroll:stop]
+
+    with ThreadPoolExecutor(max_workers=get_job_count(config)) as executor:
+        arrays = list(executor.map(render_chunk, chunks))
+    return numpy.concatenate(arrays, axis=1)
+
+
+def hash_rows(rows: numpy.ndarray) -> List[str]:
+    """
+    Digest each row of a feature matrix by its float32 bytes.
+
+    Identical rows share a digest, and each distinct row is only hashed once.
+    """
+    # adding zero folds -0.0 into 0.0, so equal rows are byte-identical
+    rows = numpy.ascontiguousarray(rows, dtype=numpy.float32) + numpy.float32(0)
+    # view each row as a single opaque value, which is far quicker to unique
+    row_bytes = rows.view(f"V{rows.shape[1] * rows.itemsize}").ravel()
+    unique_rows, inverse = numpy.unique(row_bytes, return_inverse=True)
+    digests = [
+        hashlib.blake2b(row.tobytes(), digest_size=32).hexdigest()
+        for row in unique_rows
+    ]
+    return [digests[i] for i in inverse.ravel()]
+
+
+def aggregate_windows(
+    analysis: Analysis, indices_per_partition: int, indices_per_partition_hop: int
+) -> Dict[str, numpy.ndarray]:
+    """
+    Aggregate features over every partition window of a single size at once.
+
+    Column ``i`` of each aggregate describes the window starting at index
+    ``i * indices_per_partition_hop``.
+    """
+    from numpy.lib.stride_tricks import sliding_window_view
+
+    # (features, windows, indices) view, no copying
+    windows = sliding_window_view(analysis.array, indices_per_partition, axis=1)[
+        :, ::indices_per_partition_hop
+    ]
+    means = windows.mean(axis=-1)
+    is_voiced = windows[3].astype(numpy.bool_)
+    voiced_count = is_voiced.sum(axis=-1)
+    voiced_f0_sum = numpy.where(is_voiced, windows[2], 0).sum(axis=-1)
+    # compute f0 for pitched partitions only
+    computed_is_voiced = numpy.median(windows[3], axis=-1).astype(numpy.bool_)
+    computed_f0 = numpy.full(means.shape[1], -1.0, dtype=means.dtype)
+    numpy.divide(voiced_f0_sum, voiced_count, out=computed_f0, where=computed_is_voiced)
+    return {
+        "centroid": means[5],
+        "f0": computed_f0,
+        "flatness": means[6],
+        "is_voiced": computed_is_voiced,
+        "mfcc": means[8:].T,
+        "rms": means[1],
+        "rolloff": means[7],
+    }
 
 
 def partition(
@@ -206,6 +729,36 @@ def partition(
     with timer() as t:
         hop_length_in_ms = float(analysis.hop_length) / analysis.sample_rate * 1000
         indices_per_partition_hop = math.ceil(partition_hop_in_ms / hop_length_in_ms)
+        aggregates: Dict[int, Dict[str, numpy.ndarray]] = {}
+        digests_by_size: Dict[int, List[str]] = {}
+        for partition_size in partition_sizes_in_ms:
+            indices_per_partition = math.ceil(partition_size / hop_length_in_ms)
+            if (
+                indices_per_partition not in aggregates
+                and indices_per_partition <= analysis.frame_count
+            ):
+                aggregate = aggregates[indices_per_partition] = aggregate_windows(
+                    analysis, indices_per_partition, indices_per_partition_hop
+                )
+                # hash the features to remove duplicates
+                # don't include f0 because it's not 100% deterministic
+                digests_by_size[indices_per_partition] = hash_rows(
+                    numpy.column_stack(
+                        [
+                            aggregate["centroid"],
+                            aggregate["flatness"],
+                            aggregate["is_voiced"],
+                            aggregate["mfcc"],
+                            aggregate["rms"],
+                            aggregate["rolloff"],
+                        ]
+                    )
+                )
+        # convert to Python values in bulk, rather than element by element
+        columns = {
+            size: {key: values.tolist() for key, values in aggregate.items()}
+            for size, aggregate in aggregates.items()
+        }
         partitions = []
         digests = set()
         for i, start_index in enumerate(
@@ -218,45 +771,22 @@ def partition(
                     stop_index > analysis.frame_count
                 ):  # bail on final incomplete partition
                     break
-
-                # grab subsets
-                features = analysis.features
-                centroid = features["centroid"][start_index:stop_index]
-                is_voiced = features["is_voiced"][start_index:stop_index]
-                f0 = features["f0"][start_index:stop_index]
-                flatness = features["flatness"][start_index:stop_index]
-                mfcc = features["mfcc"].T[start_index:stop_index]
-                rms = features["rms"][start_index:stop_index]
-                rolloff = features["rolloff"][start_index:stop_index]
-
-                # compute f0 for pitched partitions only
-                computed_f0 = -1.0
-                if computed_is_voiced := bool(numpy.median(is_voiced)):
-                    computed_f0 = f0[numpy.array(is_voiced, dtype=numpy.bool_)].mean()
-
-                # hash the features to remove duplicates
-                # don't include f0 because it's not 100% deterministic
-                data = dict(
-                    centroid=float(numpy.mean(centroid)),
-                    flatness=float(numpy.mean(flatness)),
-                    is_voiced=computed_is_voiced,
-                    mfcc=numpy.mean(mfcc, axis=0).tolist(),
-                    rms=float(numpy.mean(rms)),
-                    rolloff=float(numpy.mean(rolloff)),
-                )
-                digest = hashlib.sha256(
-                    json.dumps(data, sort_keys=True).encode()
-                ).hexdigest()
+                aggregate = columns[indices_per_partition]
+                digest = digests_by_size[indices_per_partition][i]
                 digests.add(digest)
-
                 partitions.append(
                     Partition(
                         path=str(analysis.path),
                         digest=digest,
                         start_frame=start_index * analysis.hop_length,
                         frame_count=(stop_index - start_index) * analysis.hop_length,
-                        f0=float(computed_f0),
-                        **data,
+                        centroid=aggregate["centroid"][i],
+                        f0=aggregate["f0"][i],
+                        flatness=aggregate["flatness"][i],
+                        is_voiced=aggregate["is_voiced"][i],
+                        mfcc=aggregate["mfcc"][i],
+                        rms=aggregate["rms"][i],
+                        rolloff=aggregate["rolloff"][i],
                     )
                 )
 
@@ -269,12 +799,127 @@ def partition(
     return partitions
 
 
+def compute_statistics(analysis: Analysis) -> Dict[str, List[float]]:
+    """
+    Compute the minimum, maximum, sum and count of an analysis' scalar features.
+    """
+    statistics: Dict[str, List[float]] = {}
+    for key in ("centroid", "f0", "flatness", "rms", "rolloff"):
+        feature = analysis.features[key]
+        if key == "f0":
+            feature = feature[~numpy.isnan(feature)]
+        statistics[key] = [
+            float(numpy.min(feature)),
+            float(numpy.max(feature)),
+            float(numpy.sum(feature)),
+            feature.shape[0],
+        ]
+    return statistics
+
+
+def merge_statistics(
+    statistics: Dict[str, List[float]], other: Dict[str, List[float]]
+) -> None:
+    for key, (minimum, maximum, sum_, count) in other.items():
+        if key not in statistics:
+            statistics[key] = [minimum, maximum, sum_, count]
+        else:
+            if minimum < statistics[key][0]:
+                statistics[key][0] = minimum
+            if maximum > statistics[key][1]:
+                statistics[key][1] = maximum
+            statistics[key][2] += sum_
+            statistics[key][3] += count
+
+
+def analyze_and_partition(
+    config: ArchonConfig,
+    path: Path,
+    path_index: int = 1,
+    path_count: int = 1,
+    setup_logging: bool = False,
+    cache_path: Optional[Path] = None,
+    description: Optional[AudioDescription] = None,
+    file_digest: Optional[str] = None,
+) -> Optional[PartitionedAnalysis]:
+    """
+    Analyze and partition a single file, discarding silent and duplicate partitions.
+    """
+    with timer() as t:
+        partitioned_analysis = _analyze_and_partition(
+            config,
+            path,
+            path_index=path_index,
+            path_count=path_count,
+            setup_logging=setup_logging,
+            cache_path=cache_path,
+            description=description,
+            file_digest=file_digest,
+        )
+    if partitioned_analysis is not None:
+        partitioned_analysis.process_id = os.getpid()
+        partitioned_analysis.elapsed = t()
+    return partitioned_analysis
+
+
+def _analyze_and_partition(
+    config: ArchonConfig,
+    path: Path,
+    path_index: int = 1,
+    path_count: int = 1,
+    setup_logging: bool = False,
+    cache_path: Optional[Path] = None,
+    description: Optional[AudioDescription] = None,
+    file_digest: Optional[str] = None,
+) -> Optional[PartitionedAnalysis]:
+    if (
+        analysis := analyze(
+            config,
+            path,
+            path_index=path_index,
+            path_count=path_count,
+            setup_logging=setup_logging,
+            cache_path=cache_path,
+            description=description,
+            file_digest=file_digest,
+        )
+    ) is None:
+        return None
+    partitions: Dict[str, Partition] = {}
+    for x in partition(
+        analysis,
+        partition_sizes_in_ms=config.partition_sizes_in_ms,
+        partition_hop_in_ms=config.partition_hop_in_ms,
+    ):
+        if x.rms < config.silence_threshold_db:  # Ignore silence
+            continue
+        partitions[x.digest] = x  # Use the hash to ignore duplicates
+    return PartitionedAnalysis(
+        path=analysis.path,
+        cache_key=analysis.cache_key,
+        statistics=compute_statistics(analysis),
+        partitions=list(partitions.values()),
+    )
+
+
+def log_utilization(
+    elapsed_by_process_id: Dict[int, List[float]], total_elapsed: float
+) -> None:
+    """
+    Log how busy each worker process was while analyzing.
+    """
+    for i, (process_id, elapsed) in enumerate(sorted(elapsed_by_process_id.items()), 1):
+        logger.info(
+            f"Worker {i} (pid={process_id}) analyzed {len(elapsed)} files "
+            f"in {sum(elapsed):.3f} seconds "
+            f"({sum(elapsed) / (total_elapsed or 1.0):.1%} utilization)"
+        )
+
+
 def run(config: ArchonConfig):
     """
     Run the pipeline.
     """
-    import librosa
-
     if config.analysis_path.exists() and config.analysis_path.is_dir():
         raise ValueError(
             f"{config.analysis_path} cannot be a directory; "
@@ -289,73 +934,79 @@ def run(config: ArchonConfig):
             if not str(path).isascii():
                 raise ValueError(f"Non-ascii path found: {path}")
         path_count = len(all_paths)
-        total_source_time = sum(
-            librosa.get_duration(filename=path) for path in all_paths
-        )
-
-        job_count = (os.cpu_count() or 4) // 2
-        analyses = [
-            x
-            for x in Parallel(n_jobs=job_count)(
-                delayed(analyze)(
-                    config,
-                    audio_path,
-                    path_index=path_index,
-                    path_count=path_count,
-                    setup_logging=True,
-                )
-                for path_index, audio_path in enumerate(all_paths, 1)
-            )
-            if x is not None
-        ]
+        descriptions = {path: describe_audio(path) for path in all_paths}
+        total_source_time = sum(x.duration for x in descriptions.values())
 
-        statistics: Dict[str, List[float]] = {}
-        partitions = {}
-        for analysis in sorted(analyses, key=lambda x: x.path):
-
-            for key in ("centroid", "f0", "flatness", "rms", "rolloff"):
-                feature = analysis.features[key]
-                if key == "f0":
-                    feature = feature[~numpy.isnan(feature)]
-                minimum = float(numpy.min(feature))
-                maximum = float(numpy.max(feature))
-                sum_ = float(numpy.sum(feature))
-                if key not in statistics:
-                    statistics[key] = [minimum, maximum, sum_, feature.shape[0]]
-                else:
-                    if minimum < statistics[key][0]:
-                        statistics[key][0] = minimum
-                    if maximum > statistics[key][1]:
-                        statistics[key][1] = maximum
-                    statistics[key][2] += sum_
-                    statistics[key][3] += feature.shape[0]
-
-            for x in partition(
-                analysis,
-                partition_sizes_in_ms=config.partition_sizes_in_ms,
-                partition_hop_in_ms=config.partition_hop_in_ms,
-            ):
-                if x.rms < config.silence_threshold_db:  # Ignore silence
-                    continue
-                partitions[x.digest] = x  # Use the hash to ignore duplicates
-
-        data = {
-            "partitions": sorted(
-                (vars(x) for x in partitions.values()),
-                key=lambda x: (x["path"], x["start_frame"]),
-            ),
-            "statistics": {
-                key: {
-                    "minimum": value[0],
-                    "mean": float(value[2]) / value[3],
-                    "maximum": value[1],
+        job_count = get_job_count(config)
+        file_digests: Dict[Path, str] = {}
+        if config.use_cache:
+            file_digests = hash_files(config.cache_path, all_paths, job_count)
+        # split the budget between files and each file's NRT chunks, so
+        # chunked renders don't oversubscribe the cpus
+        worker_config = dataclasses.replace(
+            config, cpu_budget=max(job_count // max(min(job_count, path_count), 1), 1)
+        )
+        # schedule longest files first, so no long file is left running alone
+        # at the end while every other worker idles
+        scheduled_paths = sorted(
+            all_paths, key=lambda x: descriptions[x].duration, reverse=True
+        )
+        elapsed_by_process_id: Dict[int, List[float]] = {}
+        cache_keys: Set[str] = set()
+        statistics_by_path: Dict[Path, Dict[str, List[float]]] = {}
+        with AnalysisStoreWriter(config.analysis_path) as writer:
+            # consume results as workers finish them, so only one file's
+            # partitions are ever held in memory by the parent
+            with timer() as parallel_timer:
+                for partitioned_analysis in Parallel(
+                    n_jobs=job_count, batch_size=1, return_as="generator_unordered"
+                )(
+                    delayed(analyze_and_partition)(
+                        worker_config,
+                        audio_path,
+                        path_index=path_index,
+                        path_count=path_count,
+                        setup_logging=True,
+                        cache_path=config.cache_path if config.use_cache else None,
+                        description=descriptions[audio_path],
+                        file_digest=file_digests.get(audio_path),
+                    )
+                    for path_index, audio_path in enumerate(scheduled_paths, 1)
+                ):
+                    if partitioned_analysis is None:
+                        continue
+                    elapsed_by_process_id.setdefault(
+                        partitioned_analysis.process_id, []
+                    ).append(partitioned_analysis.elapsed)
+                    if partitioned_analysis.cache_key:
+                        cache_keys.add(partitioned_analysis.cache_key)
+                    statistics_by_path[partitioned_analysis.path] = (
+                        partitioned_analysis.statistics
+                    )
+                    writer.append(vars(x) for x in partitioned_analysis.partitions)
+                log_utilization(elapsed_by_process_id, parallel_timer())
+            # merge in path order, so float sums don't depend on arrival order
+            statistics: Dict[str, List[float]] = {}
+            for path in sorted(statistics_by_path):
+                merge_statistics(statistics, statistics_by_path[path])
+            store = writer.close(
+                statistics={
+                    key: {
+                        "minimum": value[0],
+                        "mean": float(value[2]) / value[3],
+                        "maximum": value[1],
+                    }
+                    for key, value in statistics.items()
                 }
-                for key, value in statistics.items()
-            },
-        }
-        config.analysis_path.write_text(json.dumps(data, sort_keys=True, indent=2))
+            )
+        if config.use_cache and (
+            pruned_count := prune_cache(config.cache_path, cache_keys)
+        ):
+            logger.info(f"Pruned {pruned_count} stale cache entries")
+        if config.build_index:
+            Database.new(config).save_index()
         logger.info(
-            f"Pipeline finished analyzing (n={len(partitions)}) "
+            f"Pipeline finished analyzing (n={len(store)}) "
             f"{total_source_time:.3f} seconds of audio "
             f"in {t():.3f} seconds"
         )
@@ -366,11 +1017,9 @@ def validate(config: ArchonConfig):
     Validate an analysis file.
     """
     logger.info(f"Validating {config.analysis_path} ...")
-    analysis = json.loads(config.analysis_path.read_text())
+    store = AnalysisStore.read(config.analysis_path)
     missing = False
-    for audio_path in sorted(
-        set(config.root_path / x["path"] for x in analysis["partitions"])
-    ):
+    for audio_path in sorted(set(config.root_path / x for x in store.paths)):
         if audio_path.exists():
             logger.info(f"- {audio_path}: exists!")
         else:
@@ -1,14 +1,21 @@
 import dataclasses
+import hashlib
 import json
 import logging
+import os
+import pickle
+import tempfile
+from collections import OrderedDict
 from pathlib import Path
-from typing import List, Tuple
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 
 import numpy
-from scipy.spatial import KDTree
+from numpy.typing import ArrayLike, DTypeLike
 
 from .analysis import AnalysisTarget
 from .config import ArchonConfig
+from .index import BucketedIndex, IVFIndex, Index, KDTreeIndex
+from .store import COLUMNS, AnalysisStore
 from .utils import timer
 
 logger = logging.getLogger(__name__)
@@ -37,6 +44,16 @@ class RangeSet:
     rms: Range
     rolloff: Range
 
+    @classmethod
+    def from_statistics(cls, statistics: Dict[str, Dict[str, float]]) -> "RangeSet":
+        return cls(
+            centroid=Range(**statistics["centroid"]),
+            f0=Range(**statistics["f0"]),
+            flatness=Range(**statistics["flatness"]),
+            rms=Range(**statistics["rms"]),
+            rolloff=Range(**statistics["rolloff"]),
+        )
+
     def scale(self, value: float, range_: Range) -> float:
         return (value - range_.minimum) / (range_.maximum - range_.minimum)
 
@@ -50,13 +67,63 @@ class RangeSet:
         )
 
 
+class QueryCache:
+    """
+    A least-recently-used cache of query results, keyed by quantized points.
+
+    Points falling in the same ``step``-sized grid cell share results, so
+    sustained sounds don't re-query the database. Results for a larger ``k``
+    also answer queries for a smaller one.
+    """
+
+    def __init__(self, size: int = 256, step: float = 0.05):
+        self.size = size
+        self.step = step
+        self.results: OrderedDict[Tuple[int, ...], Tuple[int, List[Entry]]] = (
+            OrderedDict()
+        )
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.results)
+
+    def get_key(self, point: Sequence[float]) -> Tuple[int, ...]:
+        return tuple(numpy.floor(numpy.asarray(point) / self.step).astype(int).tolist())
+
+    def get(self, key: Tuple[int, ...], k: int) -> Optional[List[Entry]]:
+        if (result := self.results.get(key)) is None or result[0] < k:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.results.move_to_end(key)
+        return result[1][:k]
+
+    def put(self, key: Tuple[int, ...], entries: List[Entry], k: int) -> None:
+        if (result := self.results.get(key)) is None or result[0] <= k:
+            self.results[key] = (k, entries)
+        self.results.move_to_end(key)
+        while len(self.results) > self.size:
+            self.results.popitem(last=False)
+            self.evictions += 1
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / max(self.hits + self.misses, 1)
+
+
 @dataclasses.dataclass
 class Database:
     config: ArchonConfig
-    entries: List[Entry]
-    kdtree: KDTree
+    store: AnalysisStore
+    index: Index
     range_set: RangeSet
     kd: int
+    transform: Optional[numpy.ndarray] = None
+    query_cache: Optional[QueryCache] = None
+    entry_counts: Optional[numpy.ndarray] = None  # times each entry was played
+    rows_by_digest: Optional[Dict[bytes, int]] = None
 
     @classmethod
     def build_point(
@@ -73,72 +140,353 @@ class Database:
         rms: float,
         rolloff: float,
     ):
-        point = []
+        return tuple(
+            cls.build_points_from_columns(
+                range_set=range_set,
+                mfcc_count=mfcc_count,
+                use_pitch=use_pitch,
+                use_spectral=use_spectral,
+                use_mfcc=use_mfcc,
+                centroid=[centroid],
+                f0=[f0],
+                flatness=[flatness],
+                mfcc=[mfcc],
+                rms=[rms],
+                rolloff=[rolloff],
+            )[0].tolist()
+        )
+
+    @classmethod
+    def build_points_from_columns(
+        cls,
+        range_set: RangeSet,
+        mfcc_count: int,
+        use_pitch: bool,
+        use_spectral: bool,
+        use_mfcc: bool,
+        centroid: ArrayLike,
+        f0: ArrayLike,
+        flatness: ArrayLike,
+        mfcc: ArrayLike,
+        rms: ArrayLike,
+        rolloff: ArrayLike,
+        dtype: DTypeLike = numpy.float64,
+    ) -> numpy.ndarray:
+        """
+        Build an (N x d) matrix of points from columns of N features each.
+
+        Scaling happens in double precision, whatever the columns' precision,
+        before casting to ``dtype``.
+        """
+        columns: List[ArrayLike] = []
         if use_pitch:
-            point.append(f0)
+            columns.append(f0)
         if use_spectral:
-            point.extend(
+            columns.extend(
                 range_set.transform(
-                    centroid=centroid, flatness=flatness, rms=rms, rolloff=rolloff
+                    centroid=numpy.asarray(centroid, dtype=numpy.float64),
+                    flatness=numpy.asarray(flatness, dtype=numpy.float64),
+                    rms=numpy.asarray(rms, dtype=numpy.float64),
+                    rolloff=numpy.asarray(rolloff, dtype=numpy.float64),
                 )
             )
         if use_mfcc:
-            mfcc_slice = mfcc[:mfcc_count]
-            point.extend(mfcc_slice)
-        return tuple(point)
+            columns.extend(numpy.asarray(mfcc)[:, :mfcc_count].T)
+        points = numpy.empty((numpy.shape(f0)[0], len(columns)), dtype=dtype)
+        for i, column in enumerate(columns):
+            points[:, i] = column
+        return points
 
     @classmethod
-    def new(cls, config: ArchonConfig) -> "Database":
-        logger.info(f"Loading database from {config.analysis_path} ...")
+    def build_points_from_features(
+        cls,
+        config: ArchonConfig,
+        range_set: RangeSet,
+        features: numpy.ndarray,
+        dtype: DTypeLike = numpy.float64,
+    ) -> numpy.ndarray:
+        """
+        Build points from an (N x 48) feature matrix, laid out as in a store.
+        """
+        offset = len(COLUMNS)
+        return cls.build_points_from_columns(
+            range_set=range_set,
+            mfcc_count=config.mfcc_count,
+            use_pitch=config.use_pitch,
+            use_spectral=config.use_spectral,
+            use_mfcc=config.use_mfcc,
+            centroid=features[:, COLUMNS.index("centroid")],
+            f0=features[:, COLUMNS.index("f0")],
+            flatness=features[:, COLUMNS.index("flatness")],
+            mfcc=features[:, offset:],
+            rms=features[:, COLUMNS.index("rms")],
+            rolloff=features[:, COLUMNS.index("rolloff")],
+            dtype=dtype,
+        )
+
+    @classmethod
+    def build_points(
+        cls,
+        config: ArchonConfig,
+        store: AnalysisStore,
+        range_set: RangeSet,
+        transform: Optional[numpy.ndarray] = None,
+        chunk_size: int = 2**16,
+    ) -> numpy.ndarray:
         with timer() as t:
-            analysis = json.loads(config.analysis_path.read_text())
-            range_set = RangeSet(
-                centroid=Range(**analysis["statistics"]["centroid"]),
-                f0=Range(**analysis["statistics"]["f0"]),
-                flatness=Range(**analysis["statistics"]["flatness"]),
-                rms=Range(**analysis["statistics"]["rms"]),
-                rolloff=Range(**analysis["statistics"]["rolloff"]),
+            points = cls.build_points_from_features(
+                config, range_set, store.features, dtype=numpy.float32
             )
-            entries = []
-            points: List[Tuple[float, ...]] = []
-            for partition in analysis["partitions"]:
-                entries.append(
-                    Entry(
-                        path=Path(partition["path"]),
-                        starting_frame=partition["start_frame"],
-                        frame_count=partition["frame_count"],
-                        digest=partition["digest"],
-                    )
-                )
-                points.append(
-                    cls.build_point(
-                        range_set=range_set,
-                        mfcc_count=config.mfcc_count,
-                        use_pitch=config.use_pitch,
-                        use_spectral=config.use_spectral,
-                        use_mfcc=config.use_mfcc,
-                        centroid=partition["centroid"],
-                        f0=partition["f0"],
-                        flatness=partition["flatness"],
-                        mfcc=partition["mfcc"],
-                        rms=partition["rms"],
-                        rolloff=partition["rolloff"],
-                    )
+            if transform is not None:
+                transform_t = transform.T.astype(numpy.float32)
+                for start in range(0, len(points), chunk_size):
+                    stop = min(start + chunk_size, len(points))
+                    points[start:stop] = points[start:stop] @ transform_t
+            logger.info(f"Built {len(points)} points in {t():.4f} seconds")
+        return points
+
+    @classmethod
+    def get_transform(
+        cls, config: ArchonConfig, store: AnalysisStore, range_set: RangeSet
+    ) -> Optional[numpy.ndarray]:
+        """
+        Get a (d x d) linear transform of points into the space queried, if any.
+
+        Points are optionally whitened against the corpus covariance, so
+        correlated or wide-ranging features don't dominate distances, then
+        weighted per feature.
+        """
+        if not config.whiten and not config.feature_weights:
+            return None
+        # points are an affine function of features, so recover its linear part
+        feature_count = store.features.shape[1]
+        origin = cls.build_points_from_features(
+            config, range_set, numpy.zeros((1, feature_count))
+        )
+        jacobian = (
+            cls.build_points_from_features(config, range_set, numpy.eye(feature_count))
+            - origin
+        ).T
+        transform = numpy.eye(len(jacobian))
+        if config.whiten:
+            covariance = jacobian @ store.get_covariance() @ jacobian.T
+            eigenvalues, eigenvectors = numpy.linalg.eigh(covariance)
+            # regularize, so constant features don't blow up
+            eigenvalues = numpy.maximum(eigenvalues, 0) + 1e-9 * eigenvalues.max()
+            # ZCA whitening keeps each dimension aligned with its feature
+            transform = (eigenvectors / numpy.sqrt(eigenvalues)) @ eigenvectors.T
+        names = list(COLUMNS) + ["mfcc"] * (feature_count - len(COLUMNS))
+        weights = [
+            config.feature_weights.get(names[i], 1.0)
+            for i in numpy.abs(jacobian).argmax(axis=1)
+        ]
+        return numpy.asarray(weights)[:, None] * transform
+
+    @classmethod
+    def get_index_path(cls, config: ArchonConfig) -> Path:
+        """
+        Locate the persisted index for the config's combination of features.
+        """
+        name = config.index_type
+        if config.index_type == "ivf" and config.ivf_list_count:
+            name += str(config.ivf_list_count)
+        name += "-" + "".join(
+            flag
+            for flag, enabled in (
+                ("p", config.use_pitch),
+                ("s", config.use_spectral),
+                (f"m{config.mfcc_count}", config.use_mfcc),
+            )
+            if enabled
+        )
+        if config.use_pitch_buckets:
+            name += "-bucketed"
+        if config.whiten or config.feature_weights:
+            metric = json.dumps([sorted(config.feature_weights.items()), config.whiten])
+            name += "-" + hashlib.sha256(metric.encode()).hexdigest()[:8]
+        return AnalysisStore.get_columns_path(config.analysis_path) / f"{name}.pickle"
+
+    @classmethod
+    def build_index(
+        cls,
+        config: ArchonConfig,
+        points: numpy.ndarray,
+        f0: Optional[numpy.ndarray] = None,
+    ) -> Index:
+        if config.use_pitch_buckets and f0 is not None:
+            return BucketedIndex.new(
+                points,
+                f0,
+                new_index=lambda bucket_points: cls.build_index(config, bucket_points),
+                minimum_size=config.pitch_bucket_minimum_size,
+            )
+        if config.index_type == "ivf":
+            return IVFIndex.new(
+                points,
+                list_count=config.ivf_list_count,
+                probe_count=config.ivf_probe_count,
+            )
+        return KDTreeIndex.new(points)
+
+    @classmethod
+    def load_index(cls, config: ArchonConfig, digest: str) -> Optional[Index]:
+        """
+        Load a persisted index, if one exists and was built from ``digest``.
+        """
+        if not (index_path := cls.get_index_path(config)).exists():
+            return None
+        with index_path.open("rb") as file_pointer:
+            # the digest is pickled separately, so stale indices aren't loaded
+            if (index_digest := pickle.load(file_pointer)) != digest:
+                logger.warning(
+                    f"Ignoring stale index {index_path} "
+                    f"(built from {index_digest[:8]}, want {digest[:8]})"
                 )
-            logger.info(f"Building database with d={len(points[0])}")
+                return None
+            index = pickle.load(file_pointer)
+        # query-time settings needn't match the persisted ones
+        for sub_index in (
+            index.buckets.values() if isinstance(index, BucketedIndex) else [index]
+        ):
+            if isinstance(sub_index, IVFIndex):
+                sub_index.probe_count = config.ivf_probe_count
+        if isinstance(index, BucketedIndex):
+            index.minimum_size = config.pitch_bucket_minimum_size
+        return index
+
+    @classmethod
+    def new(cls, config: ArchonConfig) -> "Database":
+        logger.info(f"Loading database from {config.analysis_path} ...")
+        with timer() as t:
+            store = AnalysisStore.read(config.analysis_path)
+            range_set = RangeSet.from_statistics(store.statistics)
+            transform = cls.get_transform(config, store, range_set)
+            if (index := cls.load_index(config, store.digest)) is not None:
+                logger.info(f"Loaded index from {cls.get_index_path(config)}")
+            else:
+                points = cls.build_points(config, store, range_set, transform)
+                logger.info(f"Building database with d={points.shape[1]}")
+                index = cls.build_index(config, points, store.get_column("f0"))
             database = cls(
                 config=config,
-                entries=entries,
-                kdtree=KDTree(numpy.asarray(points, dtype=numpy.float32)),
+                store=store,
+                index=index,
                 range_set=range_set,
-                kd=len(points[0]),
+                kd=index.dimension,
+                transform=transform,
+                query_cache=(
+                    QueryCache(config.query_cache_size, config.query_cache_step)
+                    if config.query_cache_size
+                    else None
+                ),
+                entry_counts=cls.load_entry_counts(config, store),
             )
             logger.info(
-                f"... Loaded {len(points)} points from {config.analysis_path} "
+                f"... Loaded {len(store)} points from {config.analysis_path} "
                 f"in {t():.4f} seconds"
             )
         return database
 
+    def save_index(self) -> Path:
+        """
+        Persist the index, for loading by later databases of the same config.
+        """
+        index_path = self.get_index_path(self.config)
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            dir=index_path.parent, suffix=".tmp", delete=False
+        ) as file_pointer:
+            pickle.dump(self.store.digest, file_pointer)
+            pickle.dump(self.index, file_pointer, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(file_pointer.name, index_path)
+        logger.info(f"Saved index to {index_path}")
+        return index_path
+
+    @staticmethod
+    def get_entry_counts_path(config: ArchonConfig, digest: str) -> Path:
+        return AnalysisStore.get_columns_path(config.analysis_path) / (
+            f"entry-counts-{digest[:16]}.npy"
+        )
+
+    @classmethod
+    def load_entry_counts(
+        cls, config: ArchonConfig, store: AnalysisStore
+    ) -> Optional[numpy.ndarray]:
+        entry_counts_path = cls.get_entry_counts_path(config, store.digest)
+        if not entry_counts_path.exists():
+            return None
+        entry_counts = numpy.load(entry_counts_path)
+        if entry_counts.shape != (len(store),):
+            logger.warning(f"Ignoring mismatched entry counts {entry_counts_path}")
+            return None
+        return entry_counts
+
+    def save_entry_counts(self) -> Optional[Path]:
+        """
+        Persist how often each entry was played, for warming up later sessions.
+        """
+        if self.entry_counts is None:
+            return None
+        entry_counts_path = self.get_entry_counts_path(self.config, self.store.digest)
+        entry_counts_path.parent.mkdir(parents=True, exist_ok=True)
+        numpy.save(entry_counts_path, self.entry_counts)
+        logger.info(f"Saved entry counts to {entry_counts_path}")
+        return entry_counts_path
+
+    def record_entries(self, entries: Sequence[Entry]) -> None:
+        """
+        Count entries as played.
+        """
+        if self.entry_counts is None:
+            self.entry_counts = numpy.zeros(len(self.store), dtype=numpy.int64)
+        if self.rows_by_digest is None:
+            self.rows_by_digest = {
+                digest: i for i, digest in enumerate(self.store.digests.tolist())
+            }
+        rows = [self.rows_by_digest[entry.digest.encode()] for entry in entries]
+        numpy.add.at(self.entry_counts, rows, 1)
+
+    def estimate_entry_counts(
+        self, sample_size: int = 1000, k: int = 25, seed: int = 0
+    ) -> numpy.ndarray:
+        """
+        Estimate how often each entry would be queried, by querying a sample of
+        the stored points themselves: entries in dense regions of the corpus
+        neighbor many points, so are found by many queries.
+        """
+        rng = numpy.random.default_rng(seed)
+        sample_size = min(sample_size, len(self.store))
+        rows = numpy.sort(rng.choice(len(self.store), sample_size, replace=False))
+        points = self.build_points_from_features(
+            self.config, self.range_set, numpy.asarray(self.store.features[rows])
+        )
+        _, indices = self.query_index(points, min(k, len(self.store)))
+        indices = indices[indices < len(self.store)]
+        return numpy.bincount(indices.ravel(), minlength=len(self.store))
+
+    def get_warm_entries(self, count: int) -> List[Entry]:
+        """
+        Get up to ``count`` of the entries most likely to be queried, most likely
+        first.
+
+        Recorded entry counts are used if any, otherwise counts are estimated.
+        """
+        entry_counts = self.entry_counts
+        if entry_counts is None or not entry_counts.any():
+            with timer() as t:
+                entry_counts = self.estimate_entry_counts()
+                logger.info(f"Estimated entry counts in {t():.4f} seconds")
+        order = numpy.argsort(-entry_counts, kind="stable")[:count]
+        return [self.get_entry(i) for i in order[entry_counts[order] > 0].tolist()]
+
+    def get_entry(self, index: int) -> Entry:
+        return Entry(
+            path=Path(self.store.paths[self.store.path_indices[index]]),
+            starting_frame=int(self.store.start_frames[index]),
+            frame_count=int(self.store.frame_counts[index]),
+            digest=self.store.digests[index].decode(),
+        )
+
     def query(
         self,
         *,
@@ -163,30 +511,186 @@ class Database:
             rms=rms,
             rolloff=rolloff,
         )
+        return self.query_point(point, k=k)
+
+    def query_point(
+        self, point: Sequence[float], k: int = 25
+    ) -> List[Tuple[Entry, float]]:
         if len(point) != self.kd:
-            raise ValueError("Want {self.kd}-d, got {len(point)}-d")
+            raise ValueError(f"Want {self.kd}-d, got {len(point)}-d")
         logger.info(f"Querying point: d={len(point)} {point}")
         with timer() as t:
-            distances, indices = self.kdtree.query(point, k=k)
+            distances, indices = self.query_index(numpy.asarray([point]), k)
             logger.info(f"... Queried in {t():.4f} seconds")
-        logger.info(f"Distances: {[round(x, 3) for x in distances]}")
+        logger.info(f"Distances: {[round(x, 3) for x in distances[0]]}")
+        return self.get_results(distances[0], indices[0])
+
+    def query_index(
+        self, points: numpy.ndarray, k: int
+    ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Query the index with points as built by ``build_point``.
+        """
+        if isinstance(self.index, BucketedIndex):
+            # pitch buckets need the pitch, before any weighting or whitening
+            return self.index.query(self.transform_points(points), k, f0=points[:, 0])
+        return self.index.query(self.transform_points(points), k)
+
+    def transform_points(self, points: numpy.ndarray) -> numpy.ndarray:
+        if self.transform is None:
+            return points
+        return points @ self.transform.T.astype(points.dtype)
+
+    def get_results(
+        self, distances: numpy.ndarray, indices: numpy.ndarray
+    ) -> List[Tuple[Entry, float]]:
+        return [
+            (self.get_entry(index), round(distance, 6))
+            # missing neighbors are indexed past the end of the data
+            for distance, index in zip(distances, indices)
+            if index < len(self.store)
+        ]
+
+    def build_points_from_targets(
+        self, analysis_targets: Sequence[AnalysisTarget]
+    ) -> numpy.ndarray:
+        return self.build_points_from_columns(
+            range_set=self.range_set,
+            mfcc_count=self.config.mfcc_count,
+            use_pitch=self.config.use_pitch,
+            use_spectral=self.config.use_spectral,
+            use_mfcc=self.config.use_mfcc,
+            centroid=[target.centroid for target in analysis_targets],
+            f0=[target.f0 for target in analysis_targets],
+            flatness=[target.flatness for target in analysis_targets],
+            mfcc=[target.mfcc for target in analysis_targets],
+            rms=[target.rms for target in analysis_targets],
+            rolloff=[target.rolloff for target in analysis_targets],
+            dtype=numpy.float32,
+        )
+
+    def query_many(
+        self,
+        targets: Union[numpy.ndarray, Sequence[AnalysisTarget]],
+        k: Optional[int] = None,
+    ) -> List[List[Tuple[Entry, float]]]:
+        """
+        Query many targets at once.
+
+        Targets are either an (M x d) array of points, as built by ``build_point``,
+        or analysis targets.
+        Analysis targets are answered with their own ``k`` unless ``k`` is given.
+        """
+        if not len(targets):
+            return []
+        if isinstance(targets, numpy.ndarray):
+            points = numpy.atleast_2d(targets)
+            ks = [k or 25] * len(points)
+        else:
+            points = self.build_points_from_targets(targets)
+            ks = [k or target.k for target in targets]
+        if points.shape[1] != self.kd:
+            raise ValueError(f"Want {self.kd}-d, got {points.shape[1]}-d")
+        with timer() as t:
+            distances, indices = self.query_index(points, max(ks))
+            logger.info(f"... Queried {len(points)} points in {t():.4f} seconds")
         return [
-            (self.entries[indices[i]], round(distances[i], 6))
-            for i in range(len(distances))
+            self.get_results(distances[i, :k_], indices[i, :k_])
+            for i, k_ in enumerate(ks)
         ]
 
     def query_analysis_target(
         self, analysis_target: AnalysisTarget, k: int = 25
     ) -> List[Entry]:
-        return [
-            entry
-            for entry, distance in self.query(
-                centroid=analysis_target.centroid,
-                f0=analysis_target.f0,
-                flatness=analysis_target.flatness,
-                mfcc=analysis_target.mfcc,
-                rms=analysis_target.rms,
-                rolloff=analysis_target.rolloff,
-                k=analysis_target.k,
-            )
-        ]
+        return self.query_analysis_targets([analysis_target])[0]
+
+    def query_analysis_targets(
+        self, analysis_targets: Sequence[AnalysisTarget]
+    ) -> List[List[Entry]]:
+        """
+        Query many analysis targets at once, e.g. one per live input channel.
+
+        Cached targets are answered from the cache, and the rest with a single
+        call to ``query_many``.
+        """
+        results: Dict[int, List[Entry]] = {}
+        if (query_cache := self.query_cache) is not None and analysis_targets:
+            points = self.build_points_from_targets(analysis_targets)
+            keys = [query_cache.get_key(point) for point in points]
+            for i, (key, target) in enumerate(zip(keys, analysis_targets)):
+                if (entries := query_cache.get(key, target.k)) is not None:
+                    results[i] = entries
+        misses = [i for i in range(len(analysis_targets)) if i not in results]
+        for i, result in zip(
+            misses, self.query_many([analysis_targets[i] for i in misses])
+        ):
+            results[i] = [entry for entry, _ in result]
+            if query_cache is not None:
+                query_cache.put(keys[i], results[i], analysis_targets[i].k)
+        return [list(results[i]) for i in range(len(analysis_targets))]
+
+
+def benchmark(config: ArchonConfig, query_count: int = 1000, k: int = 25) -> List[Dict]:
+    """
+    Benchmark the approximate index's recall@k and latency against the exact index.
+
+    Queries are stored points, jittered so they don't trivially find themselves,
+    made one at a time as during performance.
+    """
+
+    def measure(index: Index, **kwargs) -> Tuple[List[numpy.ndarray], List[float]]:
+        all_indices, latencies = [], []
+        for point in queries:
+            with timer() as t:
+                _, indices = index.query(point[None], k, **kwargs)
+                latencies.append(t() * 1000)
+            all_indices.append(indices[0])
+        return all_indices, latencies
+
+    store = AnalysisStore.read(config.analysis_path)
+    range_set = RangeSet.from_statistics(store.statistics)
+    points = Database.build_points(
+        config, store, range_set, Database.get_transform(config, store, range_set)
+    )
+    rng = numpy.random.default_rng(0)
+    queries = points[rng.choice(len(points), min(query_count, len(points)), False)]
+    queries += rng.normal(scale=0.01 * points.std(axis=0), size=queries.shape)
+    logger.info(
+        f"Benchmarking {len(queries)} queries of k={k} "
+        f"against {len(points)} {points.shape[1]}-d points ..."
+    )
+    exact_index = KDTreeIndex.new(points)
+    approximate_index = IVFIndex.new(points, list_count=config.ivf_list_count)
+    list_count = len(approximate_index.centroids)
+    results = []
+    for name, index, kwargs in [("kdtree", exact_index, {})] + [
+        ("ivf", approximate_index, dict(probe_count=probe_count))
+        for probe_count in sorted(
+            {2**i for i in range(list_count.bit_length())}
+            | {min(config.ivf_probe_count, list_count)}
+        )
+    ]:
+        indices, latencies = measure(index, **kwargs)
+        if name == "kdtree":
+            expected_indices = indices
+        recall = numpy.mean(
+            [
+                len(set(actual.tolist()) & set(expected.tolist())) / k
+                for actual, expected in zip(indices, expected_indices)
+            ]
+        )
+        result = dict(
+            index=name,
+            probe_count=kwargs.get("probe_count"),
+            recall=float(recall),
+            mean_latency_ms=float(numpy.mean(latencies)),
+            p99_latency_ms=float(numpy.percentile(latencies, 99)),
+        )
+        logger.info(
+            f"{name: >6} (probes={result['probe_count'] or '-': >4}) "
+            f"recall@{k}={result['recall']:.3f} "
+            f"mean={result['mean_latency_ms']:.3f}ms "
+            f"p99={result['p99_latency_ms']:.3f}ms"
+        )
+        results.append(result)
+    return results
@@ -0,0 +1,333 @@
+import dataclasses
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import IO, Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+import numpy
+
+from .utils import timer
+
+logger = logging.getLogger(__name__)
+
+FORMAT = "columnar"
+
+COLUMNS = ("centroid", "f0", "flatness", "is_voiced", "rms", "rolloff")
+
+MFCC_COUNT = 42
+
+ARRAYS: Dict[str, Tuple[Any, Optional[int]]] = {
+    "features": (numpy.float32, len(COLUMNS) + MFCC_COUNT),
+    "path_indices": (numpy.int32, None),
+    "start_frames": (numpy.int64, None),
+    "frame_counts": (numpy.int64, None),
+    "digests": ("S64", None),
+}
+
+
+def partitions_to_arrays(
+    partitions: Iterable[Mapping[str, Any]],
+    paths: List[str],
+    path_indices_by_path: Dict[str, int],
+) -> Tuple[numpy.ndarray, ...]:
+    """
+    Convert partition dictionaries into arrays, in ``ARRAYS`` order.
+
+    Previously unseen paths are appended to ``paths``.
+    """
+    rows, path_indices, start_frames, frame_counts, digests = [], [], [], [], []
+    for partition in partitions:
+        if (path := partition["path"]) not in path_indices_by_path:
+            path_indices_by_path[path] = len(paths)
+            paths.append(path)
+        path_indices.append(path_indices_by_path[path])
+        rows.append([float(partition[key]) for key in COLUMNS] + partition["mfcc"])
+        start_frames.append(partition["start_frame"])
+        frame_counts.append(partition["frame_count"])
+        digests.append(partition["digest"])
+    return tuple(
+        numpy.asarray(values, dtype=dtype).reshape((-1, width) if width else -1)
+        for values, (dtype, width) in zip(
+            (rows, path_indices, start_frames, frame_counts, digests), ARRAYS.values()
+        )
+    )
+
+
+@dataclasses.dataclass
+class AnalysisStore:
+    """
+    Columnar storage of partitions.
+
+    On disk, a small JSON header (statistics, path table and a digest of the
+    contents) lives at the analysis path, and the partition columns live as
+    ``.npy`` files in a sibling ``.columns`` directory, which can be
+    memory-mapped rather than parsed.
+
+    Features are a single float32 matrix of ``COLUMNS`` followed by MFCCs. Their
+    covariance, for whitening query points, is stored alongside.
+    """
+
+    digest: str
+    paths: List[str]
+    statistics: Dict[str, Dict[str, float]]
+    features: numpy.ndarray
+    path_indices: numpy.ndarray
+    start_frames: numpy.ndarray
+    frame_counts: numpy.ndarray
+    digests: numpy.ndarray
+    covariance: Optional[numpy.ndarray] = None
+
+    def __len__(self) -> int:
+        return self.features.shape[0]
+
+    @staticmethod
+    def get_columns_path(analysis_path: Path) -> Path:
+        return analysis_path.with_suffix(".columns")
+
+    @classmethod
+    def compute_digest(
+        cls,
+        arrays: Iterable[numpy.ndarray],
+        paths: List[str],
+        statistics: Dict[str, Dict[str, float]],
+    ) -> str:
+        hasher = hashlib.sha256()
+        hasher.update(json.dumps([paths, statistics], sort_keys=True).encode())
+        for array in arrays:
+            hasher.update(numpy.ascontiguousarray(array).data)
+        return hasher.hexdigest()
+
+    @staticmethod
+    def compute_covariance(
+        features: numpy.ndarray, chunk_size: int = 2**16
+    ) -> numpy.ndarray:
+        """
+        Compute the (population) covariance of features, a chunk of rows at a time.
+        """
+        count = len(features)
+        sums = numpy.zeros(features.shape[1])
+        products = numpy.zeros((features.shape[1], features.shape[1]))
+        for start in range(0, count, chunk_size):
+            stop = min(start + chunk_size, count)
+            chunk = numpy.asarray(features[start:stop], dtype=numpy.float64)
+            sums += chunk.sum(axis=0)
+            products += chunk.T @ chunk
+        if not count:
+            return products
+        mean = sums / count
+        return products / count - numpy.outer(mean, mean)
+
+    def get_covariance(self) -> numpy.ndarray:
+        if self.covariance is None:
+            self.covariance = self.compute_covariance(self.features)
+        return self.covariance
+
+    @classmethod
+    def from_partitions(
+        cls,
+        partitions: Iterable[Mapping[str, Any]],
+        statistics: Dict[str, Dict[str, float]],
+    ) -> "AnalysisStore":
+        """
+        Build a store from partition dictionaries, as found in legacy JSON.
+        """
+        paths: List[str] = []
+        arrays = partitions_to_arrays(partitions, paths, {})
+        return cls(
+            cls.compute_digest(arrays, paths, statistics), paths, statistics, *arrays
+        )
+
+    @classmethod
+    def read(cls, analysis_path: Path, mmap: bool = True) -> "AnalysisStore":
+        """
+        Read a store, memory-mapping its columns if ``mmap``.
+
+        Legacy JSON analyses, with inline partitions, are converted on the fly.
+        """
+        text = analysis_path.read_text()
+        header = json.loads(text)
+        if "partitions" in header:
+            logger.info(f"Converting legacy analysis {analysis_path}")
+            store = cls.from_partitions(header["partitions"], header["statistics"])
+            store.digest = hashlib.sha256(text.encode()).hexdigest()
+            return store
+        if header.get("format") != FORMAT:
+            raise ValueError(f"Unknown analysis format in {analysis_path}")
+        if list(header["columns"]) != list(COLUMNS):
+            raise ValueError(f"Unexpected columns in {analysis_path}")
+        columns_path = cls.get_columns_path(analysis_path)
+        covariance_path = columns_path / "covariance.npy"
+        arrays = {
+            name: numpy.load(
+                columns_path / f"{name}.npy", mmap_mode="r" if mmap else None
+            )
+            for name in ARRAYS
+        }
+        # a partially written or mismatched column would misalign every lookup
+        for name, array in arrays.items():
+            if len(array) != header["partition_count"]:
+                raise ValueError(
+                    f"Column {name} in {columns_path} has {len(array)} rows, "
+                    f"expected {header['partition_count']}"
+                )
+        return cls(
+            digest=header["digest"],
+            paths=header["paths"],
+            statistics=header["statistics"],
+            covariance=(
+                numpy.load(covariance_path) if covariance_path.exists() else None
+            ),
+            **arrays,
+        )
+
+    @staticmethod
+    def write_header(
+        analysis_path: Path,
+        digest: str,
+        paths: List[str],
+        statistics: Dict[str, Dict[str, float]],
+        partition_count: int,
+    ) -> None:
+        analysis_path.write_text(
+            json.dumps(
+                {
+                    "columns": COLUMNS,
+                    "digest": digest,
+                    "format": FORMAT,
+                    "partition_count": partition_count,
+                    "paths": paths,
+                    "statistics": statistics,
+                },
+                sort_keys=True,
+                indent=2,
+            )
+        )
+
+    def write(self, analysis_path: Path) -> None:
+        columns_path = self.get_columns_path(analysis_path)
+        columns_path.mkdir(parents=True, exist_ok=True)
+        for name, (dtype, _) in ARRAYS.items():
+            numpy.save(columns_path / f"{name}.npy", getattr(self, name).astype(dtype))
+        numpy.save(columns_path / "covariance.npy", self.get_covariance())
+        # write the header last, so it only ever describes complete columns
+        self.write_header(
+            analysis_path, self.digest, self.paths, self.statistics, len(self)
+        )
+
+    def get_column(self, name: str) -> numpy.ndarray:
+        return self.features[:, COLUMNS.index(name)]
+
+    @property
+    def mfcc(self) -> numpy.ndarray:
+        offset = len(COLUMNS)
+        return self.features[:, offset:]
+
+
+class AnalysisStoreWriter:
+    """
+    Incrementally write a store, without holding its partitions in memory.
+
+    Partitions are spooled to raw files as they're appended. Closing the writer
+    sorts them by path and start frame, drops duplicate digests (keeping the
+    last, as the in-memory pipeline did) and writes the final columns in chunks.
+    """
+
+    def __init__(self, analysis_path: Path, chunk_size: int = 2**16):
+        self.analysis_path = analysis_path
+        self.chunk_size = chunk_size
+        self.columns_path = AnalysisStore.get_columns_path(analysis_path)
+        self.columns_path.mkdir(parents=True, exist_ok=True)
+        self.paths: List[str] = []
+        self.path_indices_by_path: Dict[str, int] = {}
+        self.partition_count = 0
+        self.spools: Dict[str, IO[bytes]] = {
+            name: (self.columns_path / f"{name}.spool").open("wb") for name in ARRAYS
+        }
+
+    def __enter__(self) -> "AnalysisStoreWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.cleanup()
+
+    def append(self, partitions: Iterable[Mapping[str, Any]]) -> None:
+        arrays = partitions_to_arrays(partitions, self.paths, self.path_indices_by_path)
+        for name, array in zip(ARRAYS, arrays):
+            self.spools[name].write(array.tobytes())
+        self.partition_count += len(arrays[0])
+
+    def cleanup(self) -> None:
+        for name, spool in self.spools.items():
+            spool.close()
+            (self.columns_path / f"{name}.spool").unlink(missing_ok=True)
+
+    def close(self, statistics: Dict[str, Dict[str, float]]) -> AnalysisStore:
+        with timer() as t:
+            for spool in self.spools.values():
+                spool.close()
+            spooled = {
+                name: (
+                    numpy.memmap(
+                        self.columns_path / f"{name}.spool",
+                        dtype=dtype,
+                        mode="r",
+                        shape=(self.partition_count, width) if width else None,
+                    )
+                    if self.partition_count
+                    else numpy.empty((0, width) if width else 0, dtype=dtype)
+                )
+                for name, (dtype, width) in ARRAYS.items()
+            }
+            # sort by path, then start frame
+            path_ranks = numpy.argsort(numpy.argsort(self.paths)).astype(numpy.int32)
+            order = numpy.lexsort(
+                (spooled["start_frames"], path_ranks[spooled["path_indices"]])
+            )
+            # keep the last of each digest
+            reversed_digests = numpy.asarray(spooled["digests"])[order][::-1]
+            _, indices = numpy.unique(reversed_digests, return_index=True)
+            order = order[numpy.sort(len(order) - 1 - indices)]
+            # compact the path table down to paths still referenced
+            used_path_indices = numpy.unique(spooled["path_indices"][order])
+            paths = sorted(self.paths[i] for i in used_path_indices)
+            path_indices_by_path = {path: i for i, path in enumerate(paths)}
+            path_remapping = numpy.zeros(max(len(self.paths), 1), dtype=numpy.int32)
+            path_remapping[used_path_indices] = [
+                path_indices_by_path[self.paths[i]] for i in used_path_indices
+            ]
+            outputs = {
+                name: numpy.lib.format.open_memmap(
+                    self.columns_path / f"{name}.npy",
+                    mode="w+",
+                    dtype=dtype,
+                    shape=(len(order), width) if width else (len(order),),
+                )
+                for name, (dtype, width) in ARRAYS.items()
+            }
+            for start in range(0, len(order), self.chunk_size):
+                stop = min(start + self.chunk_size, len(order))
+                for name, output in outputs.items():
+                    values = spooled[name][order[start:stop]]
+                    if name == "path_indices":
+                        values = path_remapping[values]
+                    output[start:stop] = values
+            for output in outputs.values():
+                output.flush()
+            store = AnalysisStore(
+                AnalysisStore.compute_digest(outputs.values(), paths, statistics),
+                paths,
+                statistics,
+                *outputs.values(),
+            )
+            store.covariance = store.compute_covariance(store.features, self.chunk_size)
+            numpy.save(self.columns_path / "covariance.npy", store.covariance)
+            self.cleanup()
+            store.write_header(
+                self.analysis_path, store.digest, paths, statistics, len(store)
+            )
+            logger.info(
+                f"Wrote {len(store)} of {self.partition_count} partitions "
+                f"to {self.columns_path} in {t():.3f} seconds"
+            )
+        return store
@@ -13,6 +13,7 @@ from supriya.ugens import (
     BufWr,
     CombL,
     CompanderD,
+    Delay1,
     DelayN,
     Dust,
     EnvGen,
@@ -23,6 +24,7 @@ from supriya.ugens import (
     LFDNoise3,
     LFNoise1,
     LFNoise2,
+    Latch,
     LeakDC,
     Limiter,
     Line,
@@ -31,6 +33,7 @@ from supriya.ugens import (
     Onsets,
     Out,
     Pan2,
+    Phasor,
     Pitch,
     PlayBuf,
     Rand,
@@ -104,11 +107,28 @@ def build_offline_analysis_synthdef(
     return analysis
 
 
+@synthdef()
+def offline_playback(buffer_id=0, out=0):
+    # lets offline analysis read a range of a file, loaded into a buffer
+    signal = PlayBuf.ar(
+        buffer_id=buffer_id,
+        done_action=DoneAction.FREE_SYNTH,
+        rate=BufRateScale.ir(buffer_id=buffer_id),
+    )
+    Out.ar(bus=out, source=signal)
+
+
 def build_online_analysis_synthdef(
     mfcc_count=13,
     pitch_detection_max_frequency=3000.0,
     pitch_detection_min_frequency=60.0,
+    batch_size=1,
 ):
+    """
+    Build the live analysis synthdef, replying with ``batch_size`` analysis
+    frames per ``/analysis`` message, oldest first.
+    """
+
     @synthdef()
     def analysis(in_=0, tps=10):
         source = In.ar(bus=in_)
@@ -136,21 +156,32 @@ def build_online_analysis_synthdef(
         flatness = SpecFlatness.kr(pv_chain=pv_chain)
         rolloff = SpecPcile.kr(pv_chain=pv_chain)
         mfcc = MFCC.kr(pv_chain=pv_chain, coeff_count=mfcc_count)
-        SendReply.kr(
-            command_name="/analysis",
-            source=[
-                peak,
-                rms,
-                frequency.hz_to_midi(),
-                is_voiced,
-                is_onset,
-                centroid,
-                flatness,
-                rolloff,
-                *mfcc,
-            ],
-            trigger=trigger,
-        )
+        features = [
+            peak,
+            rms,
+            frequency.hz_to_midi(),
+            is_voiced,
+            is_onset,
+            centroid,
+            flatness,
+            rolloff,
+            *mfcc,
+        ]
+        if batch_size > 1:
+            # shift each frame through a register of latches, newest first
+            frames = [[Latch.kr(source=x, trigger=trigger) for x in features]]
+            for _ in range(batch_size - 1):
+                frames.append(
+                    [
+                        Latch.kr(source=Delay1.kr(source=x), trigger=trigger)
+                        for x in frames[-1]
+                    ]
+                )
+            # count frames, replying on every batch_size-th
+            count = Phasor.kr(rate=trigger, stop=batch_size)
+            trigger = trigger * (count > batch_size - 1.5)
+            features = [x for frame in reversed(frames) for x in frame]
+        SendReply.kr(command_name="/analysis", source=features, trigger=trigger)
 
     return analysis
 
@@ -162,13 +193,22 @@ def playback(
     gain=0.0,
     out=0,
     panning=0.0,
+    region_length=1.0,
+    region_start=0.0,
     transposition=0.0,
     release_time=0.4,
 ):
+    # regions are fractions of the buffer, which may hold several entries
+    rate = transposition.semitones_to_ratio()
     signal = PlayBuf.ar(
         buffer_id=buffer_id,
         done_action=DoneAction.FREE_SYNTH,
-        rate=BufRateScale.ir(buffer_id=buffer_id) * transposition.semitones_to_ratio(),
+        rate=BufRateScale.ir(buffer_id=buffer_id) * rate,
+        start_position=BufFrames.ir(buffer_id=buffer_id) * region_start,
+    )
+    Line.kr(
+        duration=BufDur.ir(buffer_id=buffer_id) * region_length / rate,
+        done_action=DoneAction.FREE_SYNTH,
     )
     signal *= EnvGen.kr(
         envelope=Envelope.percussive(
@@ -181,8 +221,16 @@ def playback(
 
 
 @synthdef()
-def granulate(buffer_id=0, gain=0.0, out=0, panning=0.0, time_scaling=1.0):
-    duration = BufDur.kr(buffer_id=buffer_id) * time_scaling
+def granulate(
+    buffer_id=0,
+    gain=0.0,
+    out=0,
+    panning=0.0,
+    region_length=1.0,
+    region_start=0.0,
+    time_scaling=1.0,
+):
+    duration = BufDur.kr(buffer_id=buffer_id) * region_length * time_scaling
     window = Line.kr(
         duration=duration, done_action=DoneAction.FREE_SYNTH
     ).hanning_window()
@@ -193,7 +241,7 @@ def granulate(buffer_id=0, gain=0.0, out=0, panning=0.0, time_scaling=1.0):
             duration=WhiteNoise.ar().scale(-1, 1, 0.1, 0.2, exponential=True),
             interpolate=4,
             pan=WhiteNoise.ar(),
-            position=panning + (WhiteNoise.ar() * 0.1),
+            position=region_start + (panning + (WhiteNoise.ar() * 0.1)) * region_length,
             rate=WhiteNoise.ar().scale(-1, 1, -1, 0).semitones_to_ratio(),
             trigger=Dust.ar(density=window.scale(0, 1, 0, 100)),
         )
@@ -211,12 +259,14 @@ def warp(
     out=0,
     overlaps=4,
     panning=0.0,
+    region_length=1.0,
+    region_start=0.0,
     start=0.0,
     stop=1.0,
     time_scaling=1.0,
     transposition=0.0,
 ):
-    duration = BufDur.kr(buffer_id=buffer_id) * time_scaling
+    duration = BufDur.kr(buffer_id=buffer_id) * region_length * time_scaling
     window = Line.kr(
         duration=duration, done_action=DoneAction.FREE_SYNTH
     ).hanning_window()
@@ -235,9 +285,11 @@ def warp(
             frequency_scaling=frequency_scaling,
             interpolation=4,
             overlaps=overlaps,
-            pointer=(
+            pointer=region_start
+            + (
                 (pointer + LFNoise2.kr(1.0) * 0.05).clip(0.0, 1.0)
                 * ((duration - window_size) / duration)
+                * region_length
             ),
             window_rand_ratio=0.15,
             window_size=window_size,
@@ -1,10 +1,11 @@
+import bisect
 import cProfile
 import io
 import os
 import pstats
 from contextlib import contextmanager
 from time import perf_counter
-from typing import Callable, Generator
+from typing import Callable, Generator, List
 
 
 @contextmanager
@@ -30,6 +31,39 @@ def profiler():
     print(stream.getvalue())
 
 
+class Histogram:
+    """
+    A histogram of latencies, in power-of-two millisecond buckets.
+    """
+
+    def __init__(self, bucket_count: int = 14):
+        # upper bounds of each bucket, in milliseconds, then everything slower
+        self.bounds: List[float] = [2.0**i for i in range(bucket_count)]
+        self.counts = [0] * (bucket_count + 1)
+
+    def __len__(self) -> int:
+        return sum(self.counts)
+
+    def __str__(self) -> str:
+        labels = [f"<{x:g}ms" for x in self.bounds] + [f">={self.bounds[-1]:g}ms"]
+        return " ".join(
+            f"{label}:{count}" for label, count in zip(labels, self.counts) if count
+        )
+
+    def add(self, seconds: float) -> None:
+        self.counts[bisect.bisect_right(self.bounds, seconds * 1000)] += 1
+
+    def percentile(self, percentile: float) -> float:
+        """
+        Get an upper bound of the given percentile, in milliseconds.
+        """
+        threshold, total = len(self) * percentile / 100, 0
+        for bound, count in zip(self.bounds + [float("inf")], self.counts):
+            if (total := total + count) >= threshold and total:
+                return bound
+        return 0.0
+
+
 def scale(x, in_min, in_max, out_min, out_max):
     return (((x - in_min) / (in_max - in_min)) * (out_max - out_min)) + out_min
 
@@ -0,0 +1,92 @@
+import dataclasses
+import random
+
+import numpy
+import pytest
+
+from archon.analysis import AnalysisEngine
+
+
+@pytest.mark.parametrize("history_size", [1, 4, 7, 10])
+def test_AnalysisEngine(archon_config, history_size):
+    archon_config.history_size = history_size
+    analysis_engine = AnalysisEngine(archon_config)
+    assert analysis_engine.emit()[0] is None
+    random.seed(0)
+    frames = []
+    for _ in range(history_size * 5 + 3):
+        frame = dict(
+            peak=random.random(),
+            rms=random.random(),
+            f0=random.uniform(30, 100),
+            is_voiced=random.random() > 0.5,
+            is_onset=random.random() > 0.8,
+            centroid=random.uniform(500, 5000),
+            flatness=random.random(),
+            rolloff=random.uniform(50, 2500),
+            mfcc=[random.random() for _ in range(archon_config.mfcc_count)],
+        )
+        frames.append(frame)
+        analysis_engine.intake(**frame)
+        if len(frames) < history_size:
+            assert analysis_engine.emit()[0] is None
+            continue
+        # the rolling statistics agree with statistics recomputed from scratch
+        history = frames[-history_size:]
+        is_voiced = numpy.array([x["is_voiced"] for x in history])
+        f0 = numpy.array([x["f0"] for x in history])
+        analysis_target, _, _ = analysis_engine.emit()
+        assert analysis_target.f0 == pytest.approx(
+            f0[is_voiced].mean() if numpy.median(is_voiced) else -1.0
+        )
+        for key in ("peak", "rms", "is_onset", "centroid", "flatness", "rolloff"):
+            assert getattr(analysis_target, key) == pytest.approx(
+                numpy.mean([x[key] for x in history])
+            )
+        assert analysis_target.mfcc == pytest.approx(
+            numpy.mean([x["mfcc"] for x in history], axis=0).tolist()
+        )
+
+
+def test_AnalysisEngine_triggers(archon_config):
+    frame = dict(
+        peak=0.0,
+        f0=60.0,
+        is_voiced=True,
+        centroid=1000.0,
+        flatness=0.1,
+        rolloff=1000.0,
+        mfcc=[0.0] * archon_config.mfcc_count,
+    )
+    analysis_engine = AnalysisEngine(archon_config)
+    assert not analysis_engine.intake(rms=-20.0, is_onset=True, **frame)
+    archon_config.trigger_on_onsets = True
+    assert analysis_engine.intake(rms=-20.0, is_onset=True, **frame)
+    assert not analysis_engine.intake(rms=-20.0, is_onset=False, **frame)
+    archon_config.trigger_rms_threshold = -30.0
+    # only rising across the threshold triggers
+    assert [
+        analysis_engine.intake(rms=rms, is_onset=False, **frame)
+        for rms in (-40.0, -30.0, -20.0, -40.0, -35.0, -25.0)
+    ] == [False, True, False, False, False, True]
+
+
+@pytest.mark.parametrize("batch_size", [1, 3, 12])
+def test_AnalysisEngine_intake_many(archon_config, batch_size):
+    archon_config.history_size = 5
+    archon_config.trigger_rms_threshold = 0.5
+    rng = numpy.random.default_rng(0)
+    frames = rng.random((24, 8 + archon_config.mfcc_count))
+    frames[:, 3:5] = frames[:, 3:5] > 0.5
+    batched, unbatched = AnalysisEngine(archon_config), AnalysisEngine(archon_config)
+    for start in range(0, len(frames), batch_size):
+        stop = start + batch_size
+        assert batched.intake_many(frames[start:stop]) == any(
+            [unbatched.intake_many(frame) for frame in frames[start:stop]]
+        )
+        batched_target, unbatched_target = batched.emit()[0], unbatched.emit()[0]
+        if unbatched_target is None:
+            assert batched_target is None
+            continue
+        for key, value in dataclasses.asdict(unbatched_target).items():
+            assert getattr(batched_target, key) == pytest.approx(value)
@@ -1,10 +1,13 @@
+import asyncio
 import json
+from pathlib import Path
 from uuid import UUID, uuid4
 
+import pytest
 from supriya.providers import BufferProxy, Provider
 
 from archon.buffers import BufferManager
-from archon.query import Database
+from archon.query import Database, Entry
 
 
 def format_manager(manager, cache):
@@ -174,3 +177,185 @@ def test_BufferManager(archon_config):
         "d2b": {},
         "e2b": {},
     }
+
+
+class FakeProvider:
+    """
+    Just enough of a provider to allocate and free buffers without a server.
+    """
+
+    def __init__(self):
+        self.buffer_ids = iter(range(1_000_000))
+        self.freed = []
+
+    def add_buffer(self, **kwargs):
+        return BufferProxy(identifier=next(self.buffer_ids), provider=self, **kwargs)
+
+    def free_buffer(self, buffer_proxy):
+        self.freed.append(int(buffer_proxy))
+
+
+def test_BufferManager_pool(tmp_path):
+    entries = [
+        Entry(path=Path("a.wav"), starting_frame=i, frame_count=2**18, digest=str(i))
+        for i in range(4)
+    ]  # each a megabyte
+    provider = FakeProvider()
+    # by default, unreferenced buffers are freed immediately
+    manager = BufferManager(provider, root_path=tmp_path)
+    manager.increment_multiple(entries[:2], 1000)
+    manager.decrement(1000)
+    assert sorted(provider.freed) == [0, 1] and not manager.entries_to_buffers
+    provider.freed.clear()
+    manager = BufferManager(provider, root_path=tmp_path, pool_size=2)
+    manager.increment_multiple(entries[:3], 1000)
+    manager.decrement(1000)
+    assert len(manager.pool) == 2 and len(provider.freed) == 1
+    pooled_entries = [manager.buffers_to_entries[x] for x in manager.pool]
+    # pooled buffers are reused rather than reallocated
+    buffer_ = manager.increment(pooled_entries[0], 1001)
+    assert manager.buffers_to_entries[buffer_] == pooled_entries[0]
+    assert buffer_ not in manager.pool
+    manager.increment(entries[3], 1001)
+    # referencing a buffer that's already in use isn't a hit
+    manager.increment(pooled_entries[0], 1002)
+    manager.decrement(1002)
+    assert (manager.hits, manager.misses, manager.evictions) == (1, 4, 1)
+    # the least recently used buffer is evicted first
+    manager.decrement(1001)
+    assert pooled_entries[1] not in manager.entries_to_buffers
+    assert (manager.hits, manager.misses, manager.evictions) == (1, 4, 2)
+    # pools are also bounded by size
+    manager.pool_megabytes = 1.5
+    manager.evict()
+    assert len(manager.pool) == 1 and manager.pool_bytes == 2**20
+
+
+def test_BufferManager_coalesce(tmp_path):
+    def entry(path, starting_frame, frame_count=100):
+        return Entry(
+            path=Path(path),
+            starting_frame=starting_frame,
+            frame_count=frame_count,
+            digest=f"{path}:{starting_frame}",
+        )
+
+    provider = FakeProvider()
+    manager = BufferManager(provider, root_path=tmp_path, coalesce=True)
+    # overlapping and adjacent entries share a buffer, others don't
+    entries = [entry("a.wav", 50), entry("a.wav", 0), entry("a.wav", 150)]
+    entries += [entry("a.wav", 300), entry("b.wav", 0)]
+    buffers = manager.increment_multiple(entries, 1000)
+    assert [int(x) for x in buffers] == [0, 0, 0, 1, 2]
+    assert buffers[0].frame_count == 250 and buffers[0].starting_frame == 0
+    assert [manager.get_region(x) for x in entries] == [
+        (0.2, 0.4),
+        (0.0, 0.4),
+        (0.6, 0.4),
+        (0.0, 1.0),
+        (0.0, 1.0),
+    ]
+    # sharing a buffer isn't a pool hit
+    assert (manager.hits, manager.misses) == (0, 3)
+    # entries within an allocated region reuse its buffer
+    buffers = manager.increment_multiple([entry("a.wav", 100)], 1001)
+    assert [int(x) for x in buffers] == [0]
+    assert manager.get_region(entry("a.wav", 100)) == (0.4, 0.4)
+    manager.decrement(1000)
+    assert sorted(provider.freed) == [1, 2]
+    manager.decrement(1001)
+    assert sorted(provider.freed) == [0, 1, 2]
+    assert not manager.entries_to_buffers and not manager.buffers_to_members
+
+
+def test_BufferManager_preload(tmp_path):
+    entries = [
+        Entry(path=Path("a.wav"), starting_frame=i, frame_count=2**18, digest=str(i))
+        for i in range(4)
+    ]  # each a megabyte
+    provider = FakeProvider()
+    manager = BufferManager(provider, root_path=tmp_path, pool_size=3)
+    assert manager.preload(entries, megabytes=2.5) == 2
+    assert {manager.buffers_to_entries[x] for x in manager.pool} == set(entries[:2])
+    assert (manager.hits, manager.misses) == (0, 0)
+    # preloading stops when the pool is full, skipping loaded entries
+    assert manager.preload(entries) == 1
+    assert len(manager.pool) == 3 and not provider.freed
+    manager.increment(entries[0], 1000)
+    assert (manager.hits, manager.misses) == (1, 0)
+    # overlapping entries aren't coalesced, so the budget holds
+    manager = BufferManager(
+        FakeProvider(), root_path=tmp_path, pool_size=3, coalesce=True
+    )
+    assert manager.preload(entries, megabytes=2.5) == 2
+    assert len(manager.pool) == 2 and manager.megabytes <= 2.5
+
+
+@pytest.mark.asyncio
+async def test_BufferManager_readiness(tmp_path):
+    entries = [
+        Entry(path=Path("a.wav"), starting_frame=i, frame_count=100, digest=str(i))
+        for i in range(3)
+    ]
+    manager = BufferManager(FakeProvider(), root_path=tmp_path)
+    buffers = manager.increment_multiple(entries[:2], 1000)
+    assert await manager.wait_until_ready(buffers, timeout=0.01) == [False, False]
+    manager.on_done(int(buffers[0]))
+    assert await manager.wait_until_ready(buffers, timeout=0.01) == [True, False]
+    # waiting ends as soon as everything is ready
+    asyncio.get_running_loop().call_later(0.01, manager.on_done, int(buffers[1]))
+    assert await manager.wait_until_ready(buffers, timeout=60) == [True, True]
+    assert len(manager.latencies) == 2
+    # unknown and repeated replies are ignored
+    manager.on_done(int(buffers[1]))
+    manager.on_done(1234)
+    assert len(manager.latencies) == 2
+
+
+def test_BufferManager_admit(tmp_path):
+    entries = [
+        Entry(path=Path("a.wav"), starting_frame=i, frame_count=2**18, digest=str(i))
+        for i in range(6)
+    ]  # each a megabyte
+    provider = FakeProvider()
+    manager = BufferManager(provider, root_path=tmp_path, pool_size=2)
+    assert manager.admit(entries, 3) == entries[:3]
+    manager.budget_megabytes = 3.0
+    # resident entries substitute for unloaded ones
+    manager.increment_multiple(entries[4:], 1000)
+    assert manager.megabytes == 2.0
+    assert manager.admit(entries, 3) == [entries[0], entries[4], entries[5]]
+    # targets that can't fit at all are rejected
+    manager.increment_multiple(entries[:1], 1001)
+    assert manager.admit(entries[1:4], 3) == []
+    # pooled buffers are evicted to make room
+    manager.decrement(1000)
+    assert manager.admit(entries[:4], 3) == entries[:3]
+    assert manager.megabytes == 1.0 and manager.evictions == 2
+    # otherwise k shrinks to fit
+    manager.budget_megabytes = 2.0
+    assert manager.admit(entries[1:4], 3) == entries[1:2]
+
+
+def test_BufferManager_admit_coalesced(tmp_path):
+    entries = [
+        Entry(
+            path=Path("a.wav"),
+            starting_frame=i * 2**16,
+            frame_count=2**18,
+            digest=str(i),
+        )
+        for i in range(6)
+    ]  # each a megabyte, overlapping the next by three quarters
+    manager = BufferManager(
+        FakeProvider(), root_path=tmp_path, coalesce=True, budget_megabytes=2.0
+    )
+    # overlapping entries cost their coalesced region, not a megabyte each
+    admitted = manager.admit(entries, 6)
+    assert admitted == entries[:5]
+    manager.increment_multiple(admitted, 1000)
+    assert manager.megabytes == 2.0
+    # entries within resident regions cost nothing, others don't fit
+    inner = Entry(path=Path("a.wav"), starting_frame=100, frame_count=100, digest="x")
+    other = Entry(path=Path("b.wav"), starting_frame=0, frame_count=100, digest="y")
+    assert manager.admit([other, inner], 2) == [inner]
@@ -0,0 +1,122 @@
+import asyncio
+
+import pytest
+from supriya.osc import OscMessage
+
+from archon.engine import Engine
+
+
+@pytest.mark.asyncio
+async def test_Engine_triggers(archon_config, monkeypatch):
+    archon_config.history_size = 1
+    archon_config.trigger_on_onsets = True
+    archon_config.trigger_cooldown = 0.0
+    engine = Engine(archon_config)
+    engine.analysis_engines_by_node_id[1000] = engine.analysis_engine
+    targets = []
+
+    async def on_analysis_targets(analysis_targets):
+        targets.extend(analysis_targets)
+
+    monkeypatch.setattr(engine, "on_analysis_targets", on_analysis_targets)
+    # make the fallback poller too slow to matter
+    emit = engine.analysis_engine.emit
+    monkeypatch.setattr(engine.analysis_engine, "emit", lambda: (emit()[0], 60.0, 60.0))
+
+    async def send(is_onset):
+        contents = [1000, 0, 0.0, -20.0, 60.0, 1, int(is_onset), 1000.0, 0.1, 1000.0]
+        await engine.on_analysis_osc_message(
+            OscMessage("/analysis", *contents, *[0.0] * archon_config.mfcc_count)
+        )
+
+    await send(is_onset=False)
+    engine.is_running = True
+    task = asyncio.get_running_loop().create_task(engine.poll_analysis_engine())
+    await asyncio.sleep(0.01)
+    assert len(targets) == 1  # the initial poll
+    await send(is_onset=False)
+    await asyncio.sleep(0.01)
+    assert len(targets) == 1
+    await send(is_onset=True)
+    await asyncio.sleep(0.01)
+    assert len(targets) == 2  # triggered without waiting out the poll
+    engine.is_running = False
+    task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_Engine_channels(archon_config, monkeypatch):
+    archon_config.analysis_channel_count = 3
+    archon_config.history_size = 1
+    engine = Engine(archon_config)
+    assert len(engine.analysis_engines) == 3
+    for node_id, analysis_engine in enumerate(engine.analysis_engines, 1000):
+        engine.analysis_engines_by_node_id[node_id] = analysis_engine
+    targets = []
+
+    async def on_analysis_targets(analysis_targets):
+        targets.append(analysis_targets)
+
+    monkeypatch.setattr(engine, "on_analysis_targets", on_analysis_targets)
+    for node_id, f0 in [(1000, 60.0), (1002, 72.0), (9999, 84.0)]:
+        contents = [node_id, 0, 0.0, -20.0, f0, 1, 0, 1000.0, 0.1, 1000.0]
+        await engine.on_analysis_osc_message(
+            OscMessage("/analysis", *contents, *[0.0] * archon_config.mfcc_count)
+        )
+    engine.is_running = True
+    task = asyncio.get_running_loop().create_task(engine.poll_analysis_engine())
+    await asyncio.sleep(0.01)
+    engine.is_running = False
+    task.cancel()
+    # one batch of targets, from the primed channels only
+    assert [[x.f0 for x in analysis_targets] for analysis_targets in targets] == [
+        [60.0, 72.0]
+    ]
+
+
+@pytest.mark.asyncio
+async def test_Engine_channel_triggers(archon_config, monkeypatch):
+    archon_config.analysis_channel_count = 3
+    archon_config.history_size = 1
+    archon_config.polyphony = 2
+    archon_config.trigger_on_onsets = True
+    archon_config.trigger_cooldown = 0.0
+    engine = Engine(archon_config)
+    targets = []
+
+    async def on_analysis_targets(analysis_targets):
+        targets.append([x.f0 for x in analysis_targets])
+
+    monkeypatch.setattr(engine, "on_analysis_targets", on_analysis_targets)
+    for node_id, analysis_engine in enumerate(engine.analysis_engines, 1000):
+        engine.analysis_engines_by_node_id[node_id] = analysis_engine
+        # make the fallback poller too slow to matter
+        emit = analysis_engine.emit
+        monkeypatch.setattr(
+            analysis_engine, "emit", lambda emit=emit: (emit()[0], 60.0, 60.0)
+        )
+
+    async def send(node_id, f0, is_onset):
+        contents = [node_id, 0, 0.0, -20.0, f0, 1, int(is_onset), 1000.0, 0.1, 1000.0]
+        await engine.on_analysis_osc_message(
+            OscMessage("/analysis", *contents, *[0.0] * archon_config.mfcc_count)
+        )
+
+    for node_id, f0 in [(1000, 60.0), (1001, 72.0), (1002, 84.0)]:
+        await send(node_id, f0, is_onset=False)
+    engine.is_running = True
+    task = asyncio.get_running_loop().create_task(engine.poll_analysis_engine())
+    await asyncio.sleep(0.01)
+    # the initial poll is capped to the polyphony
+    assert targets == [[60.0, 72.0]]
+    await send(1002, 86.0, is_onset=True)
+    await asyncio.sleep(0.01)
+    # only the triggered channel is queried
+    assert targets == [[60.0, 72.0], [86.0]]
+    engine.pattern_futures.update({node_id: None for node_id in range(2)})
+    await send(1001, 74.0, is_onset=True)
+    await asyncio.sleep(0.01)
+    # no capacity left
+    assert len(targets) == 2
+    engine.is_running = False
+    task.cancel()
@@ -0,0 +1,33 @@
+import pytest
+from supriya.providers import BufferProxy
+
+from archon.analysis import AnalysisTarget, PatternFlavor
+from archon.patterns import PatternFactory
+
+
+@pytest.mark.parametrize("pattern_flavor", list(PatternFlavor))
+def test_PatternFactory_regions(pattern_flavor):
+    analysis_target = AnalysisTarget(
+        pattern_flavor=pattern_flavor,
+        k=3,
+        peak=0.0,
+        rms=0.0,
+        f0=60.0,
+        is_onset=0.0,
+        centroid=0.0,
+        flatness=0.0,
+        rolloff=0.0,
+        mfcc=[],
+    )
+    buffers = [BufferProxy(identifier=i, provider=None) for i in (0, 0, 1)]
+    regions = [(0.0, 0.5), (0.5, 0.5), (0.0, 1.0)]
+    pattern = PatternFactory().emit(analysis_target, buffers, out=2, regions=regions)
+    events = list(pattern)
+    assert events
+    for event in events:
+        assert event.kwargs["out"] == 2
+        # buffers are played with their own regions
+        region = event.kwargs["region_start"], event.kwargs["region_length"]
+        assert (event.kwargs["buffer_id"], region) in list(zip(buffers, regions))
+    with pytest.raises(ValueError):
+        PatternFactory().emit(analysis_target, buffers, regions=regions[:1])
@@ -1,13 +1,24 @@
+import dataclasses
 import logging
+import os
 import shutil
 from pathlib import Path
 
+import numpy
 import pytest
 
 import archon.pipeline
 from archon.config import ArchonConfig
 
 
+def test_describe_audio():
+    description = archon.pipeline.describe_audio(Path(__file__).parent / "audio-a.wav")
+    assert description == archon.pipeline.AudioDescription(
+        sample_rate=44100, frame_count=705600, channel_count=1
+    )
+    assert description.duration == 16.0
+
+
 @pytest.mark.parametrize(
     "filename, expected_shape",
     [
@@ -23,6 +34,21 @@ def test_analyze(archon_config, filename, expected_shape, caplog):
     assert analysis.array.shape == expected_shape
 
 
+@pytest.mark.parametrize("filename", ["audio-a.wav", "audio-b.wav"])
+def test_analyze_via_librosa(archon_config, filename):
+    root_path = Path(__file__).parent
+    archon_config.analysis_backend = "librosa"
+    analysis = archon.pipeline.analyze(archon_config, root_path / filename)
+    # frames line up with NRT analysis
+    assert analysis.array.shape == (50, 689)
+    assert analysis.array.dtype == numpy.float32
+    assert analysis.hop_length == 1024
+    assert not numpy.isnan(analysis.array).any()
+    assert set(numpy.unique(analysis.array[3])) <= {0.0, 1.0}
+    assert set(numpy.unique(analysis.array[4])) <= {0.0, 1.0}
+    assert archon.pipeline.partition(analysis)
+
+
 @pytest.mark.parametrize("filename", ["audio-a.wav", "audio-b.wav", "audio-c.wav"])
 def test_partition(archon_config, filename):
     root_path = Path(__file__).parent
@@ -30,6 +56,187 @@ def test_partition(archon_config, filename):
     archon.pipeline.partition(analysis)
 
 
+def test_analyze_via_nrt_chunks(archon_config, monkeypatch):
+    import soundfile
+
+    def render_nrt(
+        config,
+        path,
+        description,
+        frame_count,
+        *,
+        frame_length,
+        starting_frame=None,
+        **kwargs,
+    ):
+        # each "analysis" frame records the sample at the start of its hop
+        data, _ = soundfile.read(
+            path, start=starting_frame or 0, dtype="float32", always_2d=True
+        )
+        array = numpy.zeros((50, frame_count), dtype=numpy.float32)
+        array[0] = data[:: frame_length // 2, 0][:frame_count]
+        return array
+
+    monkeypatch.setattr(archon.pipeline, "render_nrt", render_nrt)
+    path = Path(__file__).parent / "audio-a.wav"
+    archon_config.nrt_chunk_duration = 0
+    expected, _ = archon.pipeline.analyze_via_nrt(archon_config, path)
+    archon_config.nrt_chunk_duration = 3.0
+    archon_config.nrt_chunk_overlap = 0.5
+    actual, frame_length = archon.pipeline.analyze_via_nrt(archon_config, path)
+    assert frame_length == 2048
+    assert expected.shape == actual.shape == (50, 689)
+    assert numpy.array_equal(expected, actual)
+
+
+def test_get_chunks():
+    assert archon.pipeline.get_chunks(10, 4, 1) == [(0, 4, 0), (4, 8, 1), (8, 10, 1)]
+    assert archon.pipeline.get_chunks(10, 4, 6) == [(0, 4, 0), (4, 8, 4), (8, 10, 6)]
+
+
+def test_hash_rows():
+    rows = numpy.random.random((5, 48)).astype(numpy.float32)
+    rows[3] = rows[1]
+    rows[4] = 0.0
+    rows[4, 0] = -0.0
+    digests = archon.pipeline.hash_rows(numpy.concatenate([rows, -rows[4:]]))
+    assert len(digests) == 6
+    assert all(len(digest) == 64 for digest in digests)
+    assert len(set(digests)) == 4
+    assert digests[1] == digests[3]
+    assert digests[4] == digests[5]
+    # stable across calls and independent of the other rows
+    assert archon.pipeline.hash_rows(rows[:2]) == digests[:2]
+
+
+def test_aggregate_windows():
+    array = numpy.random.random((50, 100)).astype(numpy.float32)
+    array[3] = numpy.random.random(100) > 0.5
+    analysis = archon.pipeline.Analysis(
+        path=Path("audio-a.wav"),
+        array=array,
+        frame_length=2048,
+        hop_length=1024,
+        sample_rate=44100,
+    )
+    aggregate = archon.pipeline.aggregate_windows(analysis, 22, 11)
+    assert aggregate["mfcc"].shape == (8, 42)
+    for i, start_index in enumerate(range(0, 100 - 22 + 1, 11)):
+        stop_index = start_index + 22
+        window = array[:, start_index:stop_index]
+        is_voiced = bool(numpy.median(window[3]))
+        assert aggregate["is_voiced"][i] == is_voiced
+        assert aggregate["f0"][i] == pytest.approx(
+            window[2][window[3].astype(bool)].mean() if is_voiced else -1.0
+        )
+        assert aggregate["centroid"][i] == pytest.approx(window[5].mean())
+        assert aggregate["mfcc"][i] == pytest.approx(window[8:].mean(axis=1))
+
+
+def test_aggregate_windows_f0():
+    # float32 sums differ from a per-window mean in the last places, so f0
+    # is close to, but not bit-identical with, a per-window loop
+    rng = numpy.random.default_rng(0)
+    array = numpy.zeros((50, 1000), dtype=numpy.float32)
+    array[2] = rng.uniform(40.0, 100.0, 1000)  # MIDI pitches
+    array[3] = rng.random(1000) > 0.3
+    analysis = archon.pipeline.Analysis(
+        path=Path("audio-a.wav"),
+        array=array,
+        frame_length=2048,
+        hop_length=1024,
+        sample_rate=44100,
+    )
+    aggregate = archon.pipeline.aggregate_windows(analysis, 22, 11)
+    for i, start_index in enumerate(range(0, 1000 - 22 + 1, 11)):
+        window = array[:, start_index:][:, :22]
+        if aggregate["is_voiced"][i]:
+            expected = window[2][window[3].astype(bool)].mean()
+            assert abs(aggregate["f0"][i] - expected) < 1e-4
+
+
+def test_analyze_cache(monkeypatch, tmp_path):
+    def analyze_via_nrt(config, path, **kwargs):
+        calls.append(path.name)
+        return numpy.random.random((50, 689)).astype(numpy.float32), 2048
+
+    calls = []
+    monkeypatch.setattr(archon.pipeline, "analyze_via_nrt", analyze_via_nrt)
+    config = ArchonConfig(analysis_path=tmp_path / "analysis.json")
+    for filename in ["audio-a.wav", "audio-a-duplicate.wav", "audio-b.wav"]:
+        shutil.copy(Path(__file__).parent / filename, tmp_path / filename)
+    analyses = [
+        archon.pipeline.analyze(
+            config, tmp_path / filename, cache_path=config.cache_path
+        )
+        for filename in ["audio-a.wav", "audio-a-duplicate.wav", "audio-b.wav"]
+    ]
+    # identical content shares a cache entry
+    assert calls == ["audio-a.wav", "audio-b.wav"]
+    assert analyses[0].cache_key == analyses[1].cache_key != analyses[2].cache_key
+    assert (analyses[0].array == analyses[1].array).all()
+    assert analyses[1].path == Path("audio-a-duplicate.wav")
+    # re-analyzing hits the cache
+    analysis = archon.pipeline.analyze(
+        config, tmp_path / "audio-b.wav", cache_path=config.cache_path
+    )
+    assert calls == ["audio-a.wav", "audio-b.wav"]
+    assert (analysis.array == analyses[2].array).all()
+    # changing settings misses the cache
+    archon.pipeline.analyze(
+        config, tmp_path / "audio-b.wav", cache_path=config.cache_path, hop_ratio=0.25
+    )
+    assert calls == ["audio-a.wav", "audio-b.wav", "audio-b.wav"]
+    # pruning drops everything not still in use
+    assert archon.pipeline.prune_cache(config.cache_path, {analyses[0].cache_key}) == 2
+    assert sorted(x.stem for x in config.cache_path.iterdir()) == [
+        analyses[0].cache_key
+    ]
+
+
+def test_get_cache_key(archon_config):
+    path = Path(__file__).parent / "audio-a.wav"
+    key = archon.pipeline.get_cache_key(archon_config, path)
+    # chunking changes NRT output, so it changes NRT keys
+    for field, value in [("nrt_chunk_duration", 0.0), ("nrt_chunk_overlap", 1.0)]:
+        config = dataclasses.replace(archon_config, **{field: value})
+        assert archon.pipeline.get_cache_key(config, path) != key
+    # but librosa doesn't chunk
+    librosa_config = dataclasses.replace(archon_config, analysis_backend="librosa")
+    assert archon.pipeline.get_cache_key(
+        librosa_config, path
+    ) == archon.pipeline.get_cache_key(
+        dataclasses.replace(librosa_config, nrt_chunk_duration=0.0), path
+    )
+
+
+def test_hash_files(monkeypatch, tmp_path):
+    def hash_file(path):
+        calls.append(path.name)
+        return original_hash_file(path)
+
+    calls = []
+    original_hash_file = archon.pipeline.hash_file
+    monkeypatch.setattr(archon.pipeline, "hash_file", hash_file)
+    cache_path = tmp_path / "cache"
+    paths = [tmp_path / "audio-a.wav", tmp_path / "audio-b.wav"]
+    for path in paths:
+        shutil.copy(Path(__file__).parent / path.name, path)
+    digests = archon.pipeline.hash_files(cache_path, paths)
+    assert digests == {path: original_hash_file(path) for path in paths}
+    assert sorted(calls) == ["audio-a.wav", "audio-b.wav"]
+    # unchanged files aren't rehashed
+    calls.clear()
+    assert archon.pipeline.hash_files(cache_path, paths) == digests
+    assert calls == []
+    # modified files are
+    shutil.copy(Path(__file__).parent / "audio-a.wav", paths[1])
+    os.utime(paths[1], ns=(0, 0))
+    digests = archon.pipeline.hash_files(cache_path, paths)
+    assert calls == ["audio-b.wav"]
+    assert digests[paths[0]] == digests[paths[1]]
+
+
 def test_run(caplog, tmp_path):
     caplog.set_level(logging.INFO)
     analysis_path = tmp_path / "analysis.json"
@@ -39,6 +246,58 @@ def test_run(caplog, tmp_path):
     archon.pipeline.run(config)
 
 
+def test_run_longest_first(caplog, monkeypatch, tmp_path):
+    import soundfile
+
+    def analyze_and_partition(config, path, **kwargs):
+        calls.append((path.name, config.cpu_budget))
+        return original_analyze_and_partition(config, path, **kwargs)
+
+    caplog.set_level(logging.INFO)
+    calls = []
+    original_analyze_and_partition = archon.pipeline.analyze_and_partition
+    monkeypatch.setattr(archon.pipeline, "analyze_and_partition", analyze_and_partition)
+    config = ArchonConfig(
+        analysis_path=tmp_path / "analysis.json",
+        analysis_backend="librosa",
+        cpu_budget=1,  # analyze in-process, in submission order
+    )
+    data, sample_rate = soundfile.read(Path(__file__).parent / "audio-a.wav")
+    for filename, duration in [
+        ("audio-a.wav", 4),
+        ("audio-b.wav", 16),
+        ("audio-c.wav", 8),
+    ]:
+        soundfile.write(
+            tmp_path / filename, data[: duration * sample_rate], sample_rate
+        )
+    archon.pipeline.run(config)
+    assert calls == [("audio-b.wav", 1), ("audio-c.wav", 1), ("audio-a.wav", 1)]
+    assert "Worker 1 (pid=" in caplog.text
+    assert "analyzed 3 files" in caplog.text
+
+
+@pytest.mark.parametrize(
+    "cpu_budget, cpu_count, expected",
+    [(None, 8, 4), (None, 1, 1), (None, None, 2), (3, 8, 3), (0, 8, 1), (16, 8, 8)],
+)
+def test_get_job_count(cpu_budget, cpu_count, expected, monkeypatch, tmp_path):
+    monkeypatch.setattr(archon.pipeline.os, "cpu_count", lambda: cpu_count)
+    config = ArchonConfig(
+        analysis_path=tmp_path / "analysis.json", cpu_budget=cpu_budget
+    )
+    assert archon.pipeline.get_job_count(config) == expected
+
+
+def test_log_utilization(caplog):
+    caplog.set_level(logging.INFO)
+    archon.pipeline.log_utilization({20: [1.0], 10: [2.0, 3.0]}, 10.0)
+    assert [record.getMessage() for record in caplog.records] == [
+        "Worker 1 (pid=10) analyzed 2 files in 5.000 seconds (50.0% utilization)",
+        "Worker 2 (pid=20) analyzed 1 files in 1.000 seconds (10.0% utilization)",
+    ]
+
+
 @pytest.mark.xfail(reason="f0 is not deterministic")
 def test_compare(caplog, tmp_path):
     caplog.set_level(logging.INFO)
@@ -1,8 +1,30 @@
+import dataclasses
 import json
 
+import numpy
 import pytest
 
+import archon.index
+import archon.query
+from archon.analysis import AnalysisTarget, PatternFlavor
 from archon.query import Database
+from archon.store import AnalysisStore
+
+FEATURES = ("centroid", "f0", "flatness", "mfcc", "rms", "rolloff")
+
+
+def get_features(partition):
+    return {key: partition[key] for key in FEATURES}
+
+
+def make_target(partition, k=25):
+    return AnalysisTarget(
+        pattern_flavor=PatternFlavor.WARP,
+        peak=0.0,
+        is_onset=0.0,
+        k=k,
+        **get_features(partition),
+    )
 
 
 @pytest.mark.parametrize(
@@ -89,3 +111,341 @@ def test_Database(
     actual_distances = [distance for _, distance in pairs]
     assert expected_digests == actual_digests
     assert expected_distances == actual_distances
+
+
+def test_Database_index(archon_config, tmp_path, monkeypatch):
+    analysis = json.loads(archon_config.analysis_path.read_text())
+    analysis_path = tmp_path / "analysis.json"
+    AnalysisStore.read(archon_config.analysis_path).write(analysis_path)
+    config = dataclasses.replace(archon_config, analysis_path=analysis_path)
+    database = Database.new(config)
+    assert Database.load_index(config, database.store.digest) is None
+    index_path = database.save_index()
+    assert index_path == tmp_path / "analysis.columns" / "kdtree-psm13.pickle"
+    assert Database.get_index_path(
+        dataclasses.replace(config, use_pitch=False, use_mfcc=False)
+    ) == (tmp_path / "analysis.columns" / "kdtree-s.pickle")
+    assert Database.get_index_path(
+        dataclasses.replace(config, index_type="ivf", ivf_list_count=16)
+    ) == (tmp_path / "analysis.columns" / "ivf16-psm13.pickle")
+    # a fresh index is loaded rather than rebuilt
+    monkeypatch.setattr(archon.index, "KDTree", None)
+    indexed_database = Database.new(config)
+    partition = analysis["partitions"][0]
+    kwargs = get_features(partition)
+    assert indexed_database.query(**kwargs) == database.query(**kwargs)
+    # a stale index is ignored
+    assert Database.load_index(config, "0" * 64) is None
+
+
+def test_Database_query_many(archon_config):
+    analysis = json.loads(archon_config.analysis_path.read_text())
+    database = Database.new(archon_config)
+    targets = [
+        make_target(partition, k=k)
+        for k, partition in zip([2, 5, 25], analysis["partitions"][::10])
+    ]
+    results = database.query_many(targets)
+    assert [len(x) for x in results] == [2, 5, 25]
+    for target, result in zip(targets, results):
+        assert result == database.query(
+            centroid=target.centroid,
+            f0=target.f0,
+            flatness=target.flatness,
+            mfcc=target.mfcc,
+            rms=target.rms,
+            rolloff=target.rolloff,
+            k=target.k,
+        )
+    points = database.index.kdtree.data[:3]
+    assert [
+        [entry.digest for entry, _ in result]
+        for result in database.query_many(points, k=1)
+    ] == [[digest.decode()] for digest in database.store.digests[:3]]
+    with pytest.raises(ValueError):
+        database.query_many(points[:, :-1])
+
+
+def test_IVFIndex():
+    rng = numpy.random.default_rng(0)
+    points = rng.random((1000, 18), dtype=numpy.float32)
+    queries = points[:50] + rng.normal(scale=0.01, size=(50, 18))
+    index = archon.index.IVFIndex.new(points, list_count=16, probe_count=4)
+    assert len(index) == 1000 and index.dimension == 18
+    assert sorted(index.indices.tolist()) == list(range(1000))
+    exact_distances, exact_indices = archon.index.KDTreeIndex.new(points).query(
+        queries, 25
+    )
+    # probing every list is exhaustive
+    distances, indices = index.query(queries, 25, probe_count=16)
+    assert numpy.array_equal(indices, exact_indices)
+    assert distances == pytest.approx(exact_distances, abs=1e-5)
+    # probing fewer lists is approximate, but still finds the nearest
+    distances, indices = index.query(queries, 25)
+    assert numpy.array_equal(indices[:, 0], exact_indices[:, 0])
+    assert (numpy.diff(distances, axis=1) >= 0).all()
+    # missing neighbors are indexed past the end of the data
+    distances, indices = index.query(queries[:1], 1001, probe_count=16)
+    assert numpy.isinf(distances[0, -1]) and indices[0, -1] == 1000
+
+
+def test_Database_ivf(archon_config):
+    analysis = json.loads(archon_config.analysis_path.read_text())
+    database = Database.new(archon_config)
+    ivf_database = Database.new(
+        dataclasses.replace(archon_config, index_type="ivf", ivf_probe_count=10**6)
+    )
+    assert isinstance(ivf_database.index, archon.index.IVFIndex)
+    partition = analysis["partitions"][0]
+    kwargs = get_features(partition)
+    expected = [entry for entry, _ in database.query(**kwargs, k=5)]
+    assert [entry for entry, _ in ivf_database.query(**kwargs, k=5)] == expected
+
+
+def test_benchmark(archon_config):
+    results = archon.query.benchmark(archon_config, query_count=20, k=5)
+    assert results[0]["index"] == "kdtree" and results[0]["recall"] == 1.0
+    assert {x["index"] for x in results[1:]} == {"ivf"}
+    assert results[-1]["recall"] == 1.0  # probing every list is exhaustive
+
+
+def test_Database_build_points(archon_config):
+    store = AnalysisStore.read(archon_config.analysis_path)
+    range_set = archon.query.RangeSet.from_statistics(store.statistics)
+    points = Database.build_points(archon_config, store, range_set)
+    assert points.shape == (len(store), 18) and points.dtype == numpy.float32
+    for i in (0, len(store) // 2, len(store) - 1):
+        centroid = float(store.get_column("centroid")[i])
+        expected = (
+            float(store.get_column("f0")[i]),
+            range_set.scale(centroid, range_set.centroid),
+            range_set.scale(float(store.get_column("flatness")[i]), range_set.flatness),
+            float(store.get_column("rms")[i]),  # unscaled
+            range_set.scale(float(store.get_column("rolloff")[i]), range_set.rolloff),
+            *store.mfcc[i, :13].tolist(),
+        )
+        assert points[i].tolist() == list(numpy.float32(expected).tolist())
+        assert Database.build_point(
+            range_set=range_set,
+            mfcc_count=13,
+            use_pitch=True,
+            use_spectral=True,
+            use_mfcc=True,
+            centroid=centroid,
+            f0=float(store.get_column("f0")[i]),
+            flatness=float(store.get_column("flatness")[i]),
+            mfcc=store.mfcc[i].tolist(),
+            rms=float(store.get_column("rms")[i]),
+            rolloff=float(store.get_column("rolloff")[i]),
+        ) == pytest.approx(expected)
+
+
+def test_QueryCache():
+    cache = archon.query.QueryCache(size=2, step=0.5)
+    key = cache.get_key((0.1, 0.2))
+    assert key == cache.get_key((0.4, 0.3))
+    assert key != cache.get_key((0.6, 0.3))
+    assert cache.get(key, 5) is None
+    cache.put(key, ["a", "b"], 2)
+    assert cache.get(key, 2) == ["a", "b"]
+    # larger results answer smaller queries, but not vice versa
+    assert cache.get(key, 1) == ["a"]
+    assert cache.get(key, 3) is None
+    cache.put(key, ["a"], 1)
+    assert cache.get(key, 2) == ["a", "b"]
+    cache.put(cache.get_key((1.0, 1.0)), ["b"], 5)
+    cache.get(key, 1)  # refresh, so the other entry is least recently used
+    cache.put(cache.get_key((2.0, 2.0)), ["c"], 5)
+    assert len(cache) == 2 and cache.get(key, 2) == ["a", "b"]
+    assert cache.get(cache.get_key((1.0, 1.0)), 5) is None
+    assert (cache.hits, cache.misses, cache.evictions) == (5, 3, 1)
+    assert cache.hit_rate == 5 / 8
+
+
+def test_Database_query_analysis_target_cache(archon_config, monkeypatch):
+    analysis = json.loads(archon_config.analysis_path.read_text())
+    database = Database.new(archon_config)
+    assert database.query_cache is not None
+    target = make_target(analysis["partitions"][0], k=5)
+    entries = database.query_analysis_target(target)
+    assert len(entries) == 5
+    # nearby targets reuse results without querying
+    monkeypatch.setattr(database, "query_point", None)
+    nearby_target = dataclasses.replace(target, rms=target.rms + 0.001)
+    assert database.query_analysis_target(nearby_target) == entries
+    assert (database.query_cache.hits, database.query_cache.misses) == (1, 1)
+    uncached_database = Database.new(
+        dataclasses.replace(archon_config, query_cache_size=0)
+    )
+    assert uncached_database.query_cache is None
+    assert uncached_database.query_analysis_target(target) == entries
+
+
+def test_Database_query_analysis_targets(archon_config):
+    analysis = json.loads(archon_config.analysis_path.read_text())
+    targets = [
+        make_target(partition, k=k)
+        for k, partition in zip([3, 5, 7], analysis["partitions"])
+    ]
+    database = Database.new(archon_config)
+    uncached_database = Database.new(
+        dataclasses.replace(archon_config, query_cache_size=0)
+    )
+    expected = [uncached_database.query_analysis_target(x) for x in targets]
+    assert [len(x) for x in expected] == [3, 5, 7]
+    assert uncached_database.query_analysis_targets(targets) == expected
+    assert database.query_analysis_targets([]) == []
+    # only uncached targets are queried
+    database.query_analysis_target(targets[1])
+    assert database.query_analysis_targets(targets) == expected
+    assert (database.query_cache.hits, database.query_cache.misses) == (1, 3)
+
+
+def test_Database_entry_counts(archon_config, tmp_path):
+    analysis = json.loads(archon_config.analysis_path.read_text())
+    analysis_path = tmp_path / "analysis.json"
+    AnalysisStore.read(archon_config.analysis_path).write(analysis_path)
+    archon_config = dataclasses.replace(archon_config, analysis_path=analysis_path)
+    partition = analysis["partitions"][0]
+    target = make_target(partition, k=3)
+    database = Database.new(dataclasses.replace(archon_config, query_cache_size=0))
+    assert database.entry_counts is None
+    # without recorded counts, counts are estimated
+    estimated_entries = database.get_warm_entries(5)
+    assert len(estimated_entries) == 5
+    entries = database.query_analysis_target(target)
+    # only played entries are counted
+    assert database.entry_counts is None
+    database.record_entries(entries)
+    database.record_entries(entries[:2])
+    assert database.entry_counts.sum() == 5
+    assert database.get_warm_entries(5) == entries
+    assert database.save_entry_counts().exists()
+    reloaded_database = Database.new(archon_config)
+    assert (reloaded_database.entry_counts == database.entry_counts).all()
+
+
+def test_Database_transform(archon_config):
+    analysis = json.loads(archon_config.analysis_path.read_text())
+    partition = analysis["partitions"][0]
+    kwargs = get_features(partition)
+    database = Database.new(archon_config)
+    assert database.transform is None
+    points = database.index.kdtree.data
+    # weights scale their features' dimensions
+    weighted_database = Database.new(
+        dataclasses.replace(archon_config, feature_weights={"f0": 0.5, "mfcc": 2.0})
+    )
+    weighted_points = weighted_database.index.kdtree.data
+    assert weighted_points[:, 0] == pytest.approx(points[:, 0] * 0.5, rel=1e-6)
+    assert weighted_points[:, 1:5] == pytest.approx(points[:, 1:5], rel=1e-6)
+    assert weighted_points[:, 5:] == pytest.approx(points[:, 5:] * 2.0, rel=1e-6)
+    # whitened points are uncorrelated, with unit variance
+    whitened_database = Database.new(dataclasses.replace(archon_config, whiten=True))
+    whitened_points = whitened_database.index.kdtree.data
+    assert numpy.cov(whitened_points, rowvar=False, bias=True) == pytest.approx(
+        numpy.eye(18), abs=1e-2
+    )
+    # queries are transformed alike
+    for database in (weighted_database, whitened_database):
+        (entry, distance), *_ = database.query(**kwargs)
+        assert entry.digest == partition["digest"]
+        assert distance == pytest.approx(0.0, abs=1e-3)
+    assert Database.get_index_path(whitened_database.config).name.startswith(
+        "kdtree-psm13-"
+    )
+    assert Database.get_index_path(whitened_database.config) != Database.get_index_path(
+        weighted_database.config
+    )
+
+
+def test_BucketedIndex():
+    rng = numpy.random.default_rng(0)
+    f0 = numpy.concatenate([numpy.full(300, -1.0), rng.uniform(36, 84, 700)])
+    f0[-5:] = 100.0  # a sparse octave
+    points = rng.random((1000, 18), dtype=numpy.float32)
+    points[:, 0] = f0
+    index = archon.index.BucketedIndex.new(
+        points, f0, archon.index.KDTreeIndex.new, minimum_size=50
+    )
+    keys = archon.index.BucketedIndex.get_buckets(f0)
+    assert sorted(index.buckets) == [-1, 3, 4, 5, 6, 8]
+    assert len(index) == 1000 and index.dimension == 18
+    assert index.get_plan(-1, 25) == [-1]
+    assert index.get_plan(4, 25) == [4]
+    assert index.get_plan(8, 25) == [8, 6]  # widened to the nearest octaves
+    assert index.get_plan(-1, 500) == [-1, 3, 4, 5, 6, 8]  # fell back to all
+    queries = points[[0, 500, 999]]
+    distances, indices = index.query(queries, 10, f0=queries[:, 0])
+    for query, key, row in zip(queries, keys[[0, 500, 999]], indices):
+        candidates = numpy.flatnonzero(numpy.isin(keys, index.get_plan(key, 10)))
+        expected = candidates[
+            numpy.argsort(((points[candidates] - query) ** 2).sum(axis=1))[:10]
+        ]
+        assert row.tolist() == expected.tolist()
+    # without pitches, every bucket is searched
+    exact_distances, exact_indices = archon.index.KDTreeIndex.new(points).query(
+        queries, 10
+    )
+    distances, indices = index.query(queries, 10)
+    assert numpy.array_equal(indices, exact_indices)
+    assert distances == pytest.approx(exact_distances)
+
+
+def test_BucketedIndex_get_plan():
+    rng = numpy.random.default_rng(0)
+    f0 = numpy.concatenate([numpy.full(10, -1.0), rng.uniform(36, 84, 990)])
+    points = rng.random((1000, 18), dtype=numpy.float32)
+    points[:, 0] = f0
+    index = archon.index.BucketedIndex.new(
+        points, f0, archon.index.KDTreeIndex.new, minimum_size=50
+    )
+    keys = archon.index.BucketedIndex.get_buckets(f0)
+    assert {x: len(y) for x, y in index.indices.items()} == {
+        -1: 10,
+        3: 228,
+        4: 239,
+        5: 257,
+        6: 266,
+    }
+    # a sparse unvoiced bucket searches every bucket
+    assert index.get_plan(-1, 10) == [-1, 3, 4, 5, 6]
+    exact_distances, exact_indices = archon.index.KDTreeIndex.new(points).query(
+        points[:3], 10
+    )
+    distances, indices = index.query(points[:3], 10, f0=f0[:3])
+    assert numpy.array_equal(indices, exact_indices)
+    assert distances == pytest.approx(exact_distances)
+    # k larger than the nearest bucket widens to the next nearest octave
+    assert index.get_plan(4, 10) == [4]
+    assert index.get_plan(4, 300) == [4, 3]
+    query = points[keys == 4][:1]
+    distances, indices = index.query(query, 300, f0=query[:, 0])
+    candidates = numpy.flatnonzero(numpy.isin(keys, [3, 4]))
+    expected = candidates[
+        numpy.argsort(((points[candidates] - query) ** 2).sum(axis=1))[:300]
+    ]
+    assert numpy.isfinite(distances).all()
+    assert indices[0].tolist() == expected.tolist()
+
+
+def test_Database_pitch_buckets(archon_config):
+    analysis = json.loads(archon_config.analysis_path.read_text())
+    database = Database.new(
+        dataclasses.replace(
+            archon_config, use_pitch_buckets=True, pitch_bucket_minimum_size=1
+        )
+    )
+    assert isinstance(database.index, archon.index.BucketedIndex)
+    f0_by_digest = {x["digest"]: x["f0"] for x in analysis["partitions"]}
+    for partition in analysis["partitions"][::20]:
+        pairs = database.query(**get_features(partition), k=3)
+        assert pairs[0][0].digest == partition["digest"]
+        for entry, _ in pairs:
+            f0 = f0_by_digest[entry.digest]
+            # unvoiced partitions only find unvoiced partitions
+            assert (f0 < 0) == (partition["f0"] < 0)
+    with pytest.raises(ValueError):
+        dataclasses.replace(
+            archon_config, use_pitch=False, use_pitch_buckets=True
+        ).validate()
@@ -0,0 +1,117 @@
+import dataclasses
+import json
+import random
+
+import numpy
+import pytest
+
+from archon.query import Database
+from archon.store import AnalysisStore, AnalysisStoreWriter
+
+
+def test_AnalysisStore(archon_config, tmp_path):
+    analysis = json.loads(archon_config.analysis_path.read_text())
+    legacy_store = AnalysisStore.read(archon_config.analysis_path)
+    analysis_path = tmp_path / "analysis.json"
+    legacy_store.write(analysis_path)
+    store = AnalysisStore.read(analysis_path)
+    assert isinstance(store.features, numpy.memmap)
+    assert store.features.dtype == numpy.float32
+    assert len(store) == len(analysis["partitions"])
+    assert store.digest == legacy_store.digest
+    assert store.paths == sorted({x["path"] for x in analysis["partitions"]})
+    assert store.statistics == analysis["statistics"]
+    for i, partition in enumerate(analysis["partitions"]):
+        assert store.paths[store.path_indices[i]] == partition["path"]
+        assert store.start_frames[i] == partition["start_frame"]
+        assert store.digests[i].decode() == partition["digest"]
+        assert store.get_column("f0")[i] == partition["f0"]
+        assert store.mfcc[i].tolist() == partition["mfcc"]
+    legacy_database = Database.new(archon_config)
+    database = Database.new(
+        dataclasses.replace(archon_config, analysis_path=analysis_path)
+    )
+    partition = analysis["partitions"][0]
+    kwargs = {
+        key: partition[key]
+        for key in ("centroid", "f0", "flatness", "mfcc", "rms", "rolloff")
+    }
+    assert database.query(**kwargs) == legacy_database.query(**kwargs)
+
+
+def test_AnalysisStore_read_truncated(archon_config, tmp_path):
+    analysis_path = tmp_path / "analysis.json"
+    AnalysisStore.read(archon_config.analysis_path).write(analysis_path)
+    column_path = AnalysisStore.get_columns_path(analysis_path) / "start_frames.npy"
+    numpy.save(column_path, numpy.load(column_path)[:-1])
+    with pytest.raises(ValueError, match="start_frames"):
+        AnalysisStore.read(analysis_path)
+
+
+def test_AnalysisStoreWriter(archon_config, tmp_path):
+    analysis = json.loads(archon_config.analysis_path.read_text())
+    expected_store = AnalysisStore.from_partitions(
+        analysis["partitions"], analysis["statistics"]
+    )
+    partitions = list(analysis["partitions"])
+    random.shuffle(partitions)
+    # duplicate digests under a later path replace the originals
+    duplicates = [dict(x, path="audio-d.wav") for x in partitions[:5]]
+    analysis_path = tmp_path / "analysis.json"
+    with AnalysisStoreWriter(analysis_path, chunk_size=7) as writer:
+        for i in range(0, len(partitions), 13):
+            j = i + 13
+            writer.append(partitions[i:j])
+        writer.append(duplicates)
+        store = writer.close(analysis["statistics"])
+    assert sorted(x.name for x in store.get_columns_path(analysis_path).iterdir()) == [
+        "covariance.npy",
+        "digests.npy",
+        "features.npy",
+        "frame_counts.npy",
+        "path_indices.npy",
+        "start_frames.npy",
+    ]
+    assert len(store) == len(expected_store)
+    assert store.paths == expected_store.paths + ["audio-d.wav"]
+    assert store.digest == AnalysisStore.read(analysis_path).digest
+    assert [
+        (store.paths[path_index], start_frame, digest.decode())
+        for path_index, start_frame, digest in zip(
+            store.path_indices, store.start_frames, store.digests
+        )
+    ] == sorted(
+        (x["path"], x["start_frame"], x["digest"])
+        for x in [
+            x
+            for x in analysis["partitions"]
+            if x["digest"] not in {y["digest"] for y in duplicates}
+        ]
+        + duplicates
+    )
+
+
+def test_AnalysisStoreWriter_roundtrip(archon_config, tmp_path):
+    analysis = json.loads(archon_config.analysis_path.read_text())
+    expected_store = AnalysisStore.from_partitions(
+        analysis["partitions"], analysis["statistics"]
+    )
+    analysis_path = tmp_path / "analysis.json"
+    with AnalysisStoreWriter(analysis_path) as writer:
+        writer.append(reversed(analysis["partitions"]))
+        store = writer.close(analysis["statistics"])
+    assert store.digest == expected_store.digest
+    assert (store.features == expected_store.features).all()
+    assert (store.digests == expected_store.digests).all()
+
+
+def test_AnalysisStore_covariance(archon_config, tmp_path):
+    store = AnalysisStore.read(archon_config.analysis_path)
+    assert store.covariance is None
+    expected = numpy.cov(store.features.astype(numpy.float64), rowvar=False, bias=True)
+    covariance = AnalysisStore.compute_covariance(store.features, chunk_size=7)
+    assert covariance.shape == (48, 48)
+    assert covariance == pytest.approx(expected, abs=1e-9)
+    analysis_path = tmp_path / "analysis.json"
+    store.write(analysis_path)
+    assert AnalysisStore.read(analysis_path).covariance == pytest.approx(expected)
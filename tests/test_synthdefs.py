@@ -114,3 +114,11 @@ def test_build_online_analysis_synthdef():
                     source[20]: MFCC.kr[12]
         """
     )
+
+
+def test_build_online_analysis_synthdef_batched():
+    synthdef = synthdefs.build_online_analysis_synthdef(batch_size=3, mfcc_count=13)
+    send_reply = next(x for x in synthdef.ugens if type(x).__name__ == "SendReply")
+    # trigger, reply ID, command name size, command name characters, then sources
+    assert len(send_reply.inputs) == 3 + len("/analysis") + 3 * (8 + 13)
+    assert any(type(x).__name__ == "Phasor" for x in synthdef.ugens)
@@ -0,0 +1,12 @@
+from archon.utils import Histogram
+
+
+def test_Histogram():
+    histogram = Histogram(bucket_count=4)
+    assert len(histogram) == 0 and histogram.percentile(50) == 0.0
+    for seconds in (0.0005, 0.003, 0.003, 0.005, 1.0):
+        histogram.add(seconds)
+    assert histogram.counts == [1, 0, 2, 1, 1]
+    assert str(histogram) == "<1ms:1 <4ms:2 <8ms:1 >=8ms:1"
+    assert histogram.percentile(50) == 4.0
+    assert histogram.percentile(100) == float("inf")